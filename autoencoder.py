@@ -4,8 +4,6 @@ Denoising autoencoders, single-layer and deep.
 import collections
 
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.optimize
 
 # os.environ['THEANO_FLAGS'] = 'device=gpu, floatX=float32'
 # os.environ['THEANO_FLAGS'] = 'mode=DEBUG_MODE'
@@ -14,11 +12,11 @@ import theano.tensor as tt
 import theano.sandbox.rng_mrg
 
 from hinge import multi_hinge_margin
+import function_cache
+import mnist
 import plotting
-
-
-def rms(x, **kwargs):
-    return np.sqrt((x**2).mean(**kwargs))
+import profiling
+from layers import rms, sparse_mask, FileObject  # re-exported
 
 
 def show_recons(x, z):
@@ -26,23 +24,6 @@ def show_recons(x, z):
                      rows=5, cols=20, vlims=(-1, 2))
 
 
-def sparse_mask(vis_shape, n_hid, rf_shape, rng=np.random):
-    assert len(vis_shape) == 2 and len(rf_shape) == 2
-    M, N = vis_shape
-    m, n = rf_shape
-    n_vis = M * N
-
-    # find random positions for top-left corner of each RF
-    i = rng.randint(low=0, high=M-m+1, size=n_hid)
-    j = rng.randint(low=0, high=N-n+1, size=n_hid)
-
-    mask = np.zeros((M, N, n_hid), dtype='bool')
-    for k in xrange(n_hid):
-        mask[i[k]:i[k]+m, j[k]:j[k]+n, k] = True
-
-    return mask.reshape(n_vis, n_hid)
-
-
 def split_params(param_vect, numpy_params):
     split = []
     i = 0
@@ -56,6 +37,46 @@ def join_params(param_arrays):
     return np.hstack([p.flatten() for p in param_arrays])
 
 
+def shared_images(images, name='data'):
+    """Put images on the device for `batch_function`
+
+    An `ImageView` is put there as its raw (e.g. uint8) rows, in a tuple of
+    the shared data and the per-pixel scale and offset that normalize each
+    batch.
+    """
+    dtype = theano.config.floatX
+    if isinstance(images, mnist.ImageView):
+        return (theano.shared(images.data, name=name),
+                images.pixel_scale.astype(dtype),
+                images.pixel_offset.astype(dtype))
+
+    assert np.isfinite(images).all()
+    return theano.shared(images.astype(dtype), name=name)
+
+
+def batch_function(inputs, outputs, data, batch_size, updates=None):
+    """Compile a function of a batch index
+
+    Batch `index` of each shared variable in `data` is substituted for the
+    corresponding symbolic input, so the data stay on the device and each
+    call only passes an integer. Compact images (see `shared_images`) are
+    normalized to floats one batch at a time.
+    """
+    index = tt.lscalar('index')
+    rows = slice(index * batch_size, (index + 1) * batch_size)
+
+    def batch(d):
+        if isinstance(d, tuple):
+            d, scale, offset = d
+            return tt.cast(d[rows], theano.config.floatX) * scale + offset
+        return d[rows]
+
+    givens = [(x, batch(d)) for x, d in zip(inputs, data)]
+    return function_cache.function(
+        [index], outputs, updates=updates, givens=givens)
+
+
+@profiling.timed('data.shift_images')
 def shift_images(images, shape, r=1, rng=np.random):
     output = np.zeros_like(images)
     N = len(images)
@@ -73,27 +94,6 @@ def shift_images(images, shape, r=1, rng=np.random):
     return output.reshape(N, m*n)
 
 
-class FileObject(object):
-    """
-    A object that can be saved to file
-    """
-    def to_file(self, file_name):
-        d = {}
-        d['__class__'] = self.__class__
-        d['__dict__'] = self.__getstate__()
-        np.savez(file_name, **d)
-
-    @staticmethod
-    def from_file(file_name):
-        npzfile = np.load(file_name)
-        cls = npzfile['__class__'].item()
-        d = npzfile['__dict__'].item()
-
-        self = cls.__new__(cls)
-        self.__setstate__(d)
-        return self
-
-
 class Autoencoder(FileObject):
     """Autoencoder with tied weights"""
 
@@ -204,6 +204,8 @@ class Autoencoder(FileObject):
 
     def auto_sgd(self, images, deep=None, test_images=None,
                  batch_size=100, rate=0.1, noise=1., n_epochs=10):
+        import matplotlib.pyplot as plt
+
         assert not hasattr(self, 'V')
 
         dtype = theano.config.floatX
@@ -228,43 +230,50 @@ class Autoencoder(FileObject):
         if self.mask is not None:
             updates[self.W] = updates[self.W] * self.mask
 
-        train_dbn = theano.function([x], error, updates=updates)
+        with profiling.timer('data.transfer'):
+            data = shared_images(images)
+        n_batches = len(images) // batch_size
+
+        train_dbn = batch_function([x], error, [data], batch_size,
+                                   updates=updates)
         # reconstruct = deep.reconstruct if deep is not None else None
         encode = deep.encode if deep is not None else None
         decode = deep.decode if deep is not None else None
 
         # --- perform SGD
-        batches = images.reshape(-1, batch_size, images.shape[1])
-        assert np.isfinite(batches).all()
-
         for epoch in range(n_epochs):
             costs = []
-            for batch in batches:
-                costs.append(train_dbn(batch))
-                self.check_params()
+            for i in range(n_batches):
+                with profiling.timer('auto_sgd.step'):
+                    costs.append(train_dbn(i))
+            self.check_params()
 
             print "Epoch %d: %0.3f" % (epoch, np.mean(costs))
 
             if deep is not None and test_images is not None:
+                with profiling.timer('evaluate'):
+                    test = test_images
+                    codes = encode(test)
+                    recs = decode(codes)
+                    # recons = reconstruct(test_images)
+
                 # plot reconstructions on test set
-                plt.figure(2)
-                plt.clf()
-                test = test_images
-                codes = encode(test)
-                recs = decode(codes)
-                # recons = reconstruct(test_images)
-                show_recons(test, recs)
-                plt.draw()
+                with profiling.timer('plot'):
+                    plt.figure(2)
+                    plt.clf()
+                    show_recons(test, recs)
+                    plt.draw()
 
                 print "Test set: (error: %0.3f) (sparsity: %0.3f)" % (
                     rms(test - recs, axis=1).mean(), (codes > 0).mean())
 
             # plot filters for first layer only
             if deep is not None and self is deep.autos[0]:
-                plt.figure(3)
-                plt.clf()
-                plotting.filters(self.filters, rows=10, cols=20)
-                plt.draw()
+                with profiling.timer('plot'):
+                    plt.figure(3)
+                    plt.clf()
+                    plotting.filters(self.filters, rows=10, cols=20)
+                    plt.draw()
 
 
 class DeepAutoencoder(object):
@@ -328,6 +337,8 @@ class DeepAutoencoder(object):
     def auto_sgd(self, images, test_images=None,
                  batch_size=100, rate=0.1, n_epochs=10):
         """Adjust tied weights to be a better autoencoder"""
+        import matplotlib.pyplot as plt
+
         dtype = theano.config.floatX
 
         params = []
@@ -354,34 +365,41 @@ class DeepAutoencoder(object):
             if auto.mask is not None:
                 updates[auto.W] = updates[auto.W] * auto.mask
 
-        train_dbn = theano.function([x], error, updates=updates)
+        with profiling.timer('data.transfer'):
+            data = shared_images(images)
+        n_batches = len(images) // batch_size
+
+        train_dbn = batch_function([x], error, [data], batch_size,
+                                   updates=updates)
         reconstruct = self.reconstruct
 
         # --- perform SGD
-        batches = images.reshape(-1, batch_size, images.shape[1])
-        assert np.isfinite(batches).all()
-
         for epoch in range(n_epochs):
             costs = []
-            for batch in batches:
-                costs.append(train_dbn(batch))
+            for i in range(n_batches):
+                with profiling.timer('deep.auto_sgd.step'):
+                    costs.append(train_dbn(i))
                 # self.check_params()
 
             print "Epoch %d: %0.3f" % (epoch, np.mean(costs))
 
             if test_images is not None:
+                with profiling.timer('evaluate'):
+                    recons = reconstruct(test_images)
+
                 # plot reconstructions on test set
-                plt.figure(2)
-                plt.clf()
-                recons = reconstruct(test_images)
-                show_recons(test_images, recons)
-                plt.draw()
+                with profiling.timer('plot'):
+                    plt.figure(2)
+                    plt.clf()
+                    show_recons(test_images, recons)
+                    plt.draw()
 
             # plot filters for first layer only
-            plt.figure(3)
-            plt.clf()
-            plotting.filters(self.autos[0].filters, rows=10, cols=20)
-            plt.draw()
+            with profiling.timer('plot'):
+                plt.figure(3)
+                plt.clf()
+                plotting.filters(self.autos[0].filters, rows=10, cols=20)
+                plt.draw()
 
     def auto_sgd_down(self, images, test_images=None,
                       batch_size=100, rate=0.1, n_epochs=10):
@@ -389,6 +407,8 @@ class DeepAutoencoder(object):
 
         This should not affect the classification accuracy of the system.
         """
+        import matplotlib.pyplot as plt
+
         dtype = theano.config.floatX
 
         params = []
@@ -416,43 +436,53 @@ class DeepAutoencoder(object):
             if auto.mask is not None:
                 updates[auto.V] = updates[auto.V] * auto.mask.T
 
-        train_dbn = theano.function([x], error, updates=updates)
+        with profiling.timer('data.transfer'):
+            data = shared_images(images)
+        n_batches = len(images) // batch_size
+
+        train_dbn = batch_function([x], error, [data], batch_size,
+                                   updates=updates)
         reconstruct = self.reconstruct
 
         # --- perform SGD
-        batches = images.reshape(-1, batch_size, images.shape[1])
-        assert np.isfinite(batches).all()
-
         for epoch in range(n_epochs):
             costs = []
-            for batch in batches:
-                costs.append(train_dbn(batch))
+            for i in range(n_batches):
+                with profiling.timer('deep.auto_sgd_down.step'):
+                    costs.append(train_dbn(i))
                 # self.check_params()
 
             print "Epoch %d: %0.3f" % (epoch, np.mean(costs))
 
             if test_images is not None:
+                with profiling.timer('evaluate'):
+                    recons = reconstruct(test_images)
+
                 # plot reconstructions on test set
-                plt.figure(2)
-                plt.clf()
-                recons = reconstruct(test_images)
-                show_recons(test_images, recons)
-                plt.draw()
+                with profiling.timer('plot'):
+                    plt.figure(2)
+                    plt.clf()
+                    show_recons(test_images, recons)
+                    plt.draw()
 
             # plot filters for first layer only
-            plt.figure(3)
-            plt.clf()
-            plotting.filters(self.autos[0].filters, rows=10, cols=20)
-            plt.draw()
+            with profiling.timer('plot'):
+                plt.figure(3)
+                plt.clf()
+                plotting.filters(self.autos[0].filters, rows=10, cols=20)
+                plt.draw()
 
     def train_classifier(self, train, test, n_epochs=30):
+        import scipy.optimize
+
         dtype = theano.config.floatX
 
         # --- find codes
         images, labels = train
         n_labels = len(np.unique(labels))
         print("Train classifier: n_labels=%s" % n_labels)
-        codes = self.encode(images.astype(dtype))
+        with profiling.timer('evaluate'):
+            codes = self.encode(images.astype(dtype))
 
         codes = theano.shared(codes.astype(dtype), name='codes')
         labels = tt.cast(theano.shared(labels.astype(dtype), name='labels'), 'int32')
@@ -467,7 +497,7 @@ class DeepAutoencoder(object):
         # compute gradients
         cost, _ = self.compute_loss(tt.dot(x, W) + b, y)
         grads = tt.grad(cost, [W, b])
-        f_df = theano.function(
+        f_df = function_cache.function(
             [W, b], [cost] + grads,
             givens={x: codes, y: labels})
 
@@ -480,7 +510,8 @@ class DeepAutoencoder(object):
 
         def f_df_wrapper(p):
             w, b = split_p(p)
-            outs = f_df(w.astype(dtype), b.astype(dtype))
+            with profiling.timer('train_classifier.step'):
+                outs = f_df(w.astype(dtype), b.astype(dtype))
             cost, grad = outs[0], form_p(outs[1:])
             return cost.astype('float64'), grad.astype('float64')
 
@@ -491,6 +522,8 @@ class DeepAutoencoder(object):
         self.W, self.b = split_p(p_opt)
 
     def lbfgs(self, train_set, test_set, shift=False, n_epochs=30):
+        import scipy.optimize
+
         dtype = theano.config.floatX
 
         params = []
@@ -511,7 +544,7 @@ class DeepAutoencoder(object):
 
         # compute gradients
         grads = tt.grad(cost, params)
-        f_df = theano.function([x, y], [cost] + grads)
+        f_df = function_cache.function([x, y], [cost] + grads)
 
         np_params = [param.get_value() for param in params]
 
@@ -526,7 +559,8 @@ class DeepAutoencoder(object):
             images = shift_images(train_images, (28, 28)) if shift else train_images
             labels = train_labels
 
-            outs = f_df(images, labels)
+            with profiling.timer('lbfgs.step'):
+                outs = f_df(images, labels)
             cost, grads = outs[0], outs[1:]
             grad = join_params(grads)
             return cost.astype('float64'), grad.astype('float64')
@@ -541,6 +575,8 @@ class DeepAutoencoder(object):
     def sgd(self, train_set, test_set,
             rate=0.1, noise=0, shift=False, tradeoff=0.5, n_epochs=30, batch_size=100):
         """Use SGD to do combined autoencoder and classifier training"""
+        import matplotlib.pyplot as plt
+
         dtype = theano.config.floatX
         assert tradeoff >= 0 and tradeoff <= 1
 
@@ -582,23 +618,34 @@ class DeepAutoencoder(object):
                 updates[auto.W] = updates[auto.W] * auto.mask
                 updates[auto.V] = updates[auto.V] * auto.mask.T
 
-        train_dbn = theano.function([x, y], error, updates=updates)
-        reconstruct = self.reconstruct
-
-        # --- perform SGD
+        # --- keep the (shifted) training set on the device
         train_images, train_labels = train_set
-        train_labels = train_labels.astype('int32')
         test_images, test_labels = test_set
+        with profiling.timer('data.transfer'):
+            images = shared_images(train_images, name='images')
+            labels = tt.cast(theano.shared(
+                train_labels.astype(dtype), name='labels'), 'int32')
+        n_batches = len(train_images) // batch_size
+
+        train_dbn = batch_function([x, y], error, [images, labels], batch_size,
+                                   updates=updates)
+        reconstruct = self.reconstruct
 
+        # --- perform SGD
         for epoch in range(n_epochs):
-            images = shift_images(train_images, (28, 28)) if shift else train_images
-            labels = train_labels
-            ibatches = images.reshape(-1, batch_size, images.shape[1])
-            lbatches = labels.reshape(-1, batch_size)
+            if shift:
+                if isinstance(train_images, mnist.ImageView):
+                    shifted = shift_images(train_images.data, (28, 28))
+                else:
+                    shifted = shift_images(train_images, (28, 28)).astype(dtype)
+                with profiling.timer('data.transfer'):
+                    shared = images[0] if isinstance(images, tuple) else images
+                    shared.set_value(shifted, borrow=True)
 
             costs = []
-            for batch, label in zip(ibatches, lbatches):
-                costs.append(train_dbn(batch, label))
+            for i in range(n_batches):
+                with profiling.timer('deep.sgd.step'):
+                    costs.append(train_dbn(i))
 
             # copy back parameters (for test function)
             self.W = W.get_value()
@@ -607,24 +654,29 @@ class DeepAutoencoder(object):
             print "Epoch %d: %0.4f" % (epoch, np.mean(costs))
 
             if test_images is not None:
+                with profiling.timer('evaluate'):
+                    recons = reconstruct(test_images)
+
                 # plot reconstructions on test set
-                plt.figure(2)
-                plt.clf()
-                recons = reconstruct(test_images)
-                show_recons(test_images, recons)
-                plt.draw()
+                with profiling.timer('plot'):
+                    plt.figure(2)
+                    plt.clf()
+                    show_recons(test_images, recons)
+                    plt.draw()
 
             # plot filters for first layer only
-            plt.figure(3)
-            plt.clf()
-            plotting.filters(self.autos[0].filters, rows=10, cols=20)
-            plt.draw()
+            with profiling.timer('plot'):
+                plt.figure(3)
+                plt.clf()
+                plotting.filters(self.autos[0].filters, rows=10, cols=20)
+                plt.draw()
 
     def test(self, test_set):
         assert self.W is not None and self.b is not None
 
         images, labels = test_set
-        codes = self.encode(images)
+        with profiling.timer('evaluate'):
+            codes = self.encode(images)
 
         categories = np.unique(labels)
         inds = np.argmax(np.dot(codes, self.W) + self.b, axis=1)
@@ -632,6 +684,8 @@ class DeepAutoencoder(object):
 
 
 def test_autoencoder():
+    import matplotlib.pyplot as plt
+
     [train_images, _], _, _ = mnist()
     normalize(train_images)
 
@@ -661,6 +715,50 @@ def test_autoencoder():
     plt.show()
 
 
+def benchmark_sgd_step(n_images=10000, n_hid=500, batch_size=100,
+                       n_repeats=3):
+    """Time per SGD step when passing batches vs. indexing shared data
+
+    Each function is called once before timing, and the best of `n_repeats`
+    passes over the data is reported.
+    """
+    import time
+    dtype = theano.config.floatX
+    rng = np.random.RandomState(3)
+    images = rng.normal(size=(n_images, 784)).astype(dtype)
+    n_batches = n_images // batch_size
+
+    auto = Autoencoder((28, 28), n_hid, hid_func=tt.nnet.sigmoid)
+    x = tt.matrix('images')
+    error = tt.mean((x - auto.propdown(auto.propup(x)))**2)
+    grads = tt.grad(error, [auto.W, auto.c, auto.b])
+    updates = collections.OrderedDict(
+        (p, p - tt.cast(0.01, dtype) * g)
+        for p, g in zip([auto.W, auto.c, auto.b], grads))
+
+    by_batch = theano.function([x], error, updates=updates)
+    data = theano.shared(images, name='data')
+    by_index = batch_function([x], error, [data], batch_size, updates=updates)
+
+    batches = images.reshape(-1, batch_size, images.shape[1])
+
+    def best(step, args):
+        step(args[0])  # warm up
+        times = []
+        for _ in range(n_repeats):
+            timer = time.time()
+            for arg in args:
+                step(arg)
+            times.append((time.time() - timer) / len(args))
+        return min(times)
+
+    t_batch = best(by_batch, batches)
+    t_index = best(by_index, range(n_batches))
+
+    print "Per step: batch argument %0.3f ms, batch index %0.3f ms" % (
+        1e3 * t_batch, 1e3 * t_index)
+
+
 def test_shift_images():
     # n = 5
     # images = np.zeros((n, 9))
@@ -673,12 +771,12 @@ def test_shift_images():
     #     print image.reshape(shape)
 
     # --- timing test
-    from hunse_tools.timing import tic, toc
-    [train_images, _], _, _ = mnist()
+    import mnist
+    [train_images, _], _, _ = mnist.load()
 
-    tic()
+    profiling.enable()
     images2 = shift_images(train_images, (28, 28))
-    toc()
+    profiling.report()
 
 if __name__ == '__main__':
     # test_autoencoder()
@@ -0,0 +1,216 @@
+"""
+Evaluate many trained params files in parallel.
+
+The test set is loaded and normalized once, placed in shared memory, and
+scored against every params file by a pool of worker processes. Results are
+cached by file hash, so unchanged models are not evaluated again.
+"""
+from __future__ import print_function
+
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.sharedctypes
+import os
+import time
+
+import numpy as np
+
+import inference
+import mnist
+
+columns = ['file', 'sha1', 'sizes', 'softlif_error', 'lif_error',
+           'spiking_error', 'seconds']
+
+_shared = {}
+
+
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_params_files(paths):
+    """Expand directories and glob patterns into a sorted list of npz files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, '*.npz')))
+        elif not os.path.exists(path) and path in inference.urls:
+            inference.load_params(path)  # fetch the pretrained file
+            files.append(path)
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def _share(images, labels):
+    """Copy the test set into shared memory for worker processes
+
+    An `ImageView` is shared as its raw (e.g. uint8) rows, with its
+    normalization.
+    """
+    stats = None
+    if isinstance(images, mnist.ImageView):
+        stats = (images.scale, images.mean, images.std)
+        images = images.data
+
+    dtype = np.dtype(images.dtype)
+    shared = multiprocessing.sharedctypes.RawArray(dtype.char, images.size)
+    array = np.frombuffer(shared, dtype=dtype).reshape(images.shape)
+    array[:] = images
+    return shared, dtype.str, images.shape, labels, stats
+
+
+def _init_worker(shared, dtype, shape, labels, stats=None):
+    images = np.frombuffer(shared, dtype=dtype).reshape(shape)
+    if stats is not None:
+        scale, mean, std = stats
+        images = mnist.ImageView(images, scale=scale, mean=mean, std=std)
+    _shared['images'] = images
+    _shared['labels'] = labels
+
+
+def _evaluate(job):
+    import view
+
+    path, options = job
+    images, labels = _shared['images'], _shared['labels']
+
+    with np.load(path) as data:
+        keys = data.files
+    if not inference.is_params(keys):
+        return None  # not a params file
+
+    timer = time.time()
+    params = inference.load_params(path)
+    stats = mnist.params_stats(params)
+    if stats is not None and isinstance(images, mnist.ImageView):
+        # normalize the shared images as this network was trained
+        images = mnist.ImageView(images.base, index=images.index,
+                                 extra=images.extra, scale=images.scale,
+                                 mean=stats[0], std=stats[1])
+    stats = view.compute_static_stats(
+        params, images, labels, inference.static_variants(params['neuron'][1]),
+        n_threads=1, dtype=options['dtype'])
+    sizes = ([params['weights'][0].shape[0]] +
+             [len(b) for b in params['biases']] + [len(params['bc'])])
+    result = dict(sizes='-'.join(str(s) for s in sizes),
+                  softlif_error=stats[0]['errors'].mean(),
+                  lif_error=stats[1]['errors'].mean(),
+                  spiking_error=np.nan)
+
+    n_pres = options['presentations']
+    if n_pres > 0:
+        import run
+        pres_time = 0.1
+        t, _, test, _ = run.run_spiking(
+            params, images[:n_pres], labels, n_pres, pres_time=pres_time)
+        errors = view.compute_spiking_error(t, test, pres_time)
+        result['spiking_error'] = errors.mean()
+
+    result['seconds'] = time.time() - timer
+    return result
+
+
+def batch_eval(files, images, labels, n_workers=None, cache_file=None,
+               presentations=0, dtype='float64'):
+    """Score each params file, reusing cached results of unchanged files"""
+    options = dict(presentations=presentations, dtype=dtype,
+                   n_test=len(labels))
+    option_key = json.dumps(options, sort_keys=True)
+
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+
+    hashes = dict((path, file_hash(path)) for path in files)
+    keys = dict((path, hashes[path] + option_key) for path in files)
+    todo = [path for path in files if keys[path] not in cache]
+    print("Evaluating %d of %d files (%d cached)" % (
+        len(todo), len(files), len(files) - len(todo)))
+
+    if len(todo) > 0:
+        pool = multiprocessing.Pool(
+            n_workers, initializer=_init_worker,
+            initargs=_share(images, labels))
+        try:
+            jobs = [(path, options) for path in todo]
+            for path, result in zip(todo, pool.imap(_evaluate, jobs)):
+                cache[keys[path]] = result
+                if result is None:
+                    print("%s: not a params file" % path)
+                else:
+                    print("%s: softlif %0.2f%%, lif %0.2f%% (%0.1f s)" % (
+                        path, 100 * result['softlif_error'],
+                        100 * result['lif_error'], result['seconds']))
+        finally:
+            pool.close()
+            pool.join()
+
+        if cache_file is not None:
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f, indent=1, sort_keys=True)
+
+    rows = []
+    for path in files:
+        result = cache[keys[path]]
+        if result is not None:
+            rows.append(dict(result, file=path, sha1=hashes[path]))
+    return rows
+
+
+def write_table(rows, filename):
+    with open(filename, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(str(row[c]) for c in columns) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Evaluate many params files in parallel")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: #CPUs)")
+    parser.add_argument('--presentations', type=int, default=0,
+                        help="Also run a short spiking evaluation "
+                        "with this many presentations")
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        default='float64',
+                        help="Precision for static evaluation")
+    parser.add_argument('--cache', default='batch_eval_cache.json',
+                        help="Results cache file")
+    parser.add_argument('--output', default='batch_eval.csv',
+                        help="Where to write the results table")
+    parser.add_argument('paths', nargs='+',
+                        help="Params files, directories or glob patterns")
+    args = parser.parse_args()
+
+    files = find_params_files(args.paths)
+    if len(files) == 0:
+        raise IOError("No params files found in %s" % args.paths)
+
+    # --- load the testing data (once, as uint8, for all workers)
+    _, _, [images, labels] = mnist.load(
+        normalize=True, shuffle=True, spaun=args.spaun, compact=True)
+
+    rows = batch_eval(files, images, labels, n_workers=args.workers,
+                      cache_file=args.cache, presentations=args.presentations,
+                      dtype=args.dtype)
+    write_table(rows, args.output)
+
+    rows.sort(key=lambda row: row['lif_error'])
+    print("%-40s %10s %10s %10s" % ("file", "softlif", "lif", "spiking"))
+    for row in rows:
+        print("%-40s %9.2f%% %9.2f%% %9.2f%%" % (
+            row['file'], 100 * row['softlif_error'],
+            100 * row['lif_error'], 100 * row['spiking_error']))
+    print("Wrote results for %d files to '%s'" % (len(rows), args.output))
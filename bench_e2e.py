@@ -0,0 +1,266 @@
+"""
+End-to-end performance benchmark on a reduced MNIST workload.
+
+Trains a small network for a few epochs on a fixed subset of MNIST, then
+evaluates it statically and for a short spiking run. The wall time,
+throughput and memory of each stage and the final errors are appended
+to a history file, and compared against the median of the previous runs
+with the same settings, so that a slowdown in any stage is flagged.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import benchmarks
+import profiling
+
+neuron = ('softlif', dict(
+    sigma=0.01, tau_rc=0.02, tau_ref=0.002, gain=1, bias=1, amp=1. / 63.04))
+
+
+class Stages(object):
+    """Wall time, throughput and memory of consecutive stages
+
+    The peak resident memory of a process cannot be reset, so each stage
+    records the process peak at its end (`process_peak_rss`), and how much
+    it raised that peak (`peak_rss_delta`, zero if an earlier stage used
+    more).
+    """
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+
+    def run(self, name, f, n_items=None, unit='images'):
+        peak = profiling.peak_rss()
+        timer = time.time()
+        result = f()
+        elapsed = time.time() - timer
+
+        stage = dict(time=elapsed, process_peak_rss=profiling.peak_rss())
+        stage['peak_rss_delta'] = stage['process_peak_rss'] - peak
+        if n_items is not None:
+            stage['throughput'] = n_items / elapsed
+            stage['unit'] = '%s/s' % unit
+        self.stages[name] = stage
+
+        line = "%-12s %8.2f s %+9.1f MB peak" % (
+            name, elapsed, stage['peak_rss_delta'] / 1e6)
+        if n_items is not None:
+            line += " %10.1f %s" % (stage['throughput'], stage['unit'])
+        print(line)
+        return result
+
+
+def _subset(data, n):
+    images, labels = data
+    return images[:n], labels[:n]
+
+
+def run(n_train=10000, n_test=1000, shapes=((28, 28), 200, 100),
+        rf_shapes=((9, 9), None), n_epochs=2, n_pres=20, pres_time=0.1,
+        dt=0.001, seed=0):
+    """Train and evaluate the reduced network, timing each stage"""
+    import theano
+    import autoencoder
+    import mnist
+    import neurons
+    import run as spiking
+    import view
+
+    np.random.seed(seed)
+    stages = Stages()
+    n_layers = len(shapes) - 1
+    neuron_fn = neurons.get_theano_fn(*neuron)
+
+    train, _, test = stages.run('load', lambda: mnist.load(
+        normalize=True, shuffle=True, seed=seed))
+    train, test = _subset(train, n_train), _subset(test, n_test)
+    train_images = train[0]
+
+    def pretrain():
+        deep = autoencoder.DeepAutoencoder()
+        data = train_images
+        for i in range(n_layers):
+            auto = autoencoder.Autoencoder(
+                shapes[i], shapes[i+1], rf_shape=rf_shapes[i],
+                vis_func=None if i == 0 else neuron_fn, hid_func=neuron_fn)
+            deep.autos.append(auto)
+            auto.auto_sgd(data, n_epochs=n_epochs)
+            data = auto.encode(data)
+        return deep
+
+    deep = stages.run('pretrain', pretrain, n_train * n_epochs * n_layers)
+    stages.run('classifier', lambda: deep.train_classifier(
+        train, test, n_epochs=10 * n_epochs))
+    stages.run('finetune', lambda: deep.sgd(
+        train, (None, None), n_epochs=n_epochs, tradeoff=1, noise=0.3,
+        shift=True, rate=0.1), n_train * n_epochs)
+
+    params = dict(weights=[auto.W.get_value() for auto in deep.autos],
+                  biases=[auto.c.get_value() for auto in deep.autos],
+                  Wc=deep.W, bc=deep.b, neuron=neuron)
+    images, labels = test
+    static_errors = stages.run('static', lambda: view.compute_static_error(
+        params, images, labels, neuron), n_test)
+
+    def simulate():
+        t, _, test_out, _ = spiking.run_spiking(
+            params, images, labels, n_pres, pres_time=pres_time, dt=dt)
+        return view.compute_spiking_error(t, test_out, pres_time)
+
+    spiking_errors = stages.run('spiking', simulate, n_pres, 'presentations')
+
+    config = dict(n_train=n_train, n_test=n_test, shapes=list(shapes),
+                  n_epochs=n_epochs, n_pres=n_pres, pres_time=pres_time,
+                  dt=dt, seed=seed, floatX=theano.config.floatX)
+    errors = dict(static=float(static_errors.mean()),
+                  spiking=float(spiking_errors.mean()))
+    return dict(environment=benchmarks.environment(), config=config,
+                stages=stages.stages, errors=errors)
+
+
+def load_history(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def save_history(filename, history):
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(history, f, indent=1)
+    os.rename(tmp, filename)
+
+
+def _stage_value(stage, key):
+    if key == 'process_peak_rss' and key not in stage:
+        return stage.get('peak_rss')  # the name in older history files
+    return stage.get(key)
+
+
+def baseline(history, config, n_runs=5):
+    """Median stage times, memory and errors of recent runs like `config`"""
+    config = json.loads(json.dumps(config))  # tuples as in the history file
+    runs = [r for r in history if r['config'] == config][-n_runs:]
+    if len(runs) == 0:
+        return None
+
+    median = lambda values: float(np.median(values)) if values else None
+    stages = collections.OrderedDict()
+    for name in runs[-1]['stages']:
+        stages[name] = {}
+        for k in ['time', 'process_peak_rss', 'peak_rss_delta']:
+            values = [_stage_value(r['stages'][name], k) for r in runs
+                      if name in r['stages']]
+            stages[name][k] = median([v for v in values if v is not None])
+    errors = dict((k, median([r['errors'][k] for r in runs]))
+                  for k in runs[-1]['errors'])
+    return dict(n_runs=len(runs), stages=stages, errors=errors)
+
+
+def check(result, base, time_threshold=1.25, memory_threshold=1.25,
+          error_threshold=0.02):
+    """Print the run against the baseline, and return the regressions
+
+    Stage times and the process peak memory at the end of each stage regress
+    when above the threshold ratio of the baseline; errors when above the
+    baseline plus the threshold.
+    """
+    regressions = []
+    print("%-12s %10s %10s %8s %12s %14s %14s" % (
+        "stage", "base [s]", "time [s]", "ratio", "+peak [MB]",
+        "base proc [MB]", "proc peak [MB]"))
+    for name, stage in result['stages'].items():
+        old = base['stages'].get(name)
+        if old is None:
+            continue
+        ratio = stage['time'] / old['time']
+        flags = []
+        if ratio > time_threshold:
+            flags.append('SLOWER')
+            regressions.append('%s.time' % name)
+        if stage['process_peak_rss'] > (
+                memory_threshold * old['process_peak_rss']):
+            flags.append('MEMORY')
+            regressions.append('%s.process_peak_rss' % name)
+        print("%-12s %10.2f %10.2f %7.2fx %12.1f %14.1f %14.1f %s" % (
+            name, old['time'], stage['time'], ratio,
+            stage['peak_rss_delta'] / 1e6, old['process_peak_rss'] / 1e6,
+            stage['process_peak_rss'] / 1e6, ' '.join(flags)))
+
+    for name, error in result['errors'].items():
+        old = base['errors'].get(name)
+        if old is None:
+            continue
+        flag = ''
+        if error > old + error_threshold:
+            flag = 'WORSE'
+            regressions.append('%s.error' % name)
+        print("%-12s error %6.2f%% (base %6.2f%%) %s" % (
+            name, 100 * error, 100 * old, flag))
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark training and evaluation end-to-end on a "
+        "reduced MNIST workload")
+    parser.add_argument('--n-train', type=int, default=10000,
+                        help="Number of training images")
+    parser.add_argument('--n-test', type=int, default=1000,
+                        help="Number of test images")
+    parser.add_argument('--epochs', type=int, default=2,
+                        help="Training epochs per stage")
+    parser.add_argument('--presentations', type=int, default=20,
+                        help="Number of digits presented to the spiking "
+                        "network")
+    parser.add_argument('--history', default='bench_e2e_history.json',
+                        help="History file of previous runs")
+    parser.add_argument('--baseline-runs', type=int, default=5,
+                        help="Number of recent runs in the baseline median")
+    parser.add_argument('--time-threshold', type=float, default=1.25,
+                        help="Stage slowdown ratio counted as a regression")
+    parser.add_argument('--memory-threshold', type=float, default=1.25,
+                        help="Peak memory ratio counted as a regression")
+    parser.add_argument('--error-threshold', type=float, default=0.02,
+                        help="Error increase counted as a regression")
+    parser.add_argument('--no-save', action='store_true',
+                        help="Do not add this run to the history")
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+
+    result = run(n_train=args.n_train, n_test=args.n_test,
+                 n_epochs=args.epochs, n_pres=args.presentations)
+
+    history = load_history(args.history)
+    base = baseline(history, result['config'], n_runs=args.baseline_runs)
+    regressions = []
+    if base is None:
+        print("No previous runs with these settings in '%s'" % args.history)
+    else:
+        print("Baseline: median of %d previous runs" % base['n_runs'])
+        regressions = check(result, base,
+                            time_threshold=args.time_threshold,
+                            memory_threshold=args.memory_threshold,
+                            error_threshold=args.error_threshold)
+
+    if not args.no_save:
+        result['regressions'] = regressions
+        history.append(result)
+        save_history(args.history, history)
+        print("Added run to '%s'" % args.history)
+
+    if len(regressions) > 0:
+        print("%d regressions: %s" % (len(regressions), ', '.join(regressions)))
+        sys.exit(1)
@@ -0,0 +1,266 @@
+"""
+Micro-benchmarks of the project's hot kernels.
+
+Each benchmark runs on fixed, seeded inputs and reports the best time per
+call over several repeats (the least noisy estimate). Results are written
+as JSON with the git revision and library versions, so that runs on
+different revisions can be compared with `--compare`. Benchmarks whose
+dependencies (Theano, Nengo, the MNIST data) are unavailable are skipped.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+benchmarks = collections.OrderedDict()
+
+neuron_params = dict(tau_rc=0.02, tau_ref=0.002, gain=1, bias=1,
+                     amp=1. / 63.04)
+
+# earlier names of benchmarks, so that older results can be compared
+renamed = {
+    'neurons.softrelu': 'inference.softrelu',
+    'neurons.lif_j': 'inference.lif_j',
+    'view._propup_static': 'inference.propup',
+}
+
+
+def benchmark(name):
+    """Register a benchmark
+
+    The decorated function does the setup, and returns the callable to time.
+    """
+    def decorator(setup):
+        benchmarks[name] = setup
+        return setup
+    return decorator
+
+
+def _currents(shape=(1000, 500)):
+    rng = np.random.RandomState(0)
+    return rng.normal(scale=2., size=shape).astype('float32')
+
+
+@benchmark('inference.softrelu')
+def _softrelu():
+    import inference
+    x = _currents()
+    return lambda: inference.softrelu(x, sigma=0.01)
+
+
+@benchmark('inference.lif_j')
+def _lif_j():
+    import inference
+    j = _currents()
+    return lambda: inference.lif_j(j, 0.02, 0.002, 1. / 63.04)
+
+
+@benchmark('neurons.d_softlif')
+def _d_softlif():
+    import neurons
+    x = _currents()
+    return lambda: neurons.d_softlif(x, sigma=0.01, **neuron_params)
+
+
+@benchmark('neurons.SoftLIFRate.step_math')
+def _step_math():
+    import neurons
+    neuron = neurons.SoftLIFRate(sigma=0.01, tau_rc=0.02, tau_ref=0.002)
+    J = _currents() + 1
+    output = np.zeros_like(J)
+    return lambda: neuron.step_math(0.001, J, output)
+
+
+def _images(n=10000):
+    rng = np.random.RandomState(1)
+    return rng.uniform(size=(n, 784)).astype('float32')
+
+
+@benchmark('autoencoder.shift_images')
+def _shift_images():
+    import autoencoder
+    images = _images()
+    return lambda: autoencoder.shift_images(
+        images, (28, 28), rng=np.random.RandomState(2))
+
+
+@benchmark('autoencoder.sparse_mask')
+def _sparse_mask():
+    import autoencoder
+    return lambda: autoencoder.sparse_mask(
+        (28, 28), 1000, (9, 9), rng=np.random.RandomState(3))
+
+
+@benchmark('hinge.MultiHingeMargin.perform')
+def _hinge():
+    import hinge
+    rng = np.random.RandomState(4)
+    X = rng.normal(size=(10000, 10)).astype('float32')
+    y = rng.randint(10, size=10000).astype('int32')
+    out = [[None], [None]]
+    return lambda: hinge.multi_hinge_margin.perform(None, [X, y], out)
+
+
+@benchmark('plotting.tile')
+def _tile():
+    import matplotlib.pyplot as plt
+    import plotting
+    filters = _images(1000).reshape(-1, 28, 28)
+    plt.figure()
+
+    def run():
+        plt.clf()
+        plotting.tile(filters, rows=20, cols=50, grid=True)
+    return run
+
+
+@benchmark('mnist.load')
+def _mnist_load():
+    import mnist
+    if not os.path.exists('mnist.pkl.gz'):
+        raise IOError("'mnist.pkl.gz' is not downloaded")
+    return lambda: mnist.load(normalize=True, shuffle=True)
+
+
+@benchmark('mnist.synthetic_images')
+def _synthetic_images():
+    import mnist
+    return lambda: mnist.synthetic_images(10000)
+
+
+@benchmark('inference.propup')
+def _propup():
+    import inference
+    rng = np.random.RandomState(5)
+    sizes = [784, 500, 200]
+    params = dict(
+        weights=[rng.normal(scale=0.05, size=s).astype('float32')
+                 for s in zip(sizes[:-1], sizes[1:])],
+        biases=[np.zeros(s, dtype='float32') for s in sizes[1:]],
+        Wc=rng.normal(scale=0.05, size=(200, 10)).astype('float32'),
+        bc=np.zeros(10, dtype='float32'))
+    images = _images(1000)
+    return lambda: inference.propup(params, images, ('lif', neuron_params))
+
+
+@benchmark('view.compute_spiking_error')
+def _spiking_error():
+    import view
+    dt, pres_time, n_pres = 0.001, 0.1, 1000
+    t = dt * np.arange(1, int(round(n_pres * pres_time / dt)) + 1)
+    test = np.random.RandomState(6).uniform(size=t.size)
+    return lambda: view.compute_spiking_error(t, test, pres_time)
+
+
+def _time(f, repeat=5, min_time=0.2):
+    """Best time per call, with enough calls per repeat to fill `min_time`"""
+    once = min(timeit.repeat(f, number=1, repeat=2))
+    number = max(1, int(min_time / max(once, 1e-9)))
+    times = np.array(timeit.repeat(f, number=number, repeat=repeat)) / number
+    return dict(best=times.min(), median=np.median(times), number=number,
+                repeat=repeat)
+
+
+def run(names=None, repeat=5):
+    results = collections.OrderedDict()
+    for name, setup in benchmarks.items():
+        if names is not None and not any(n in name for n in names):
+            continue
+        try:
+            f = setup()
+        except (ImportError, IOError) as e:
+            results[name] = dict(skipped=str(e))
+            print("%-36s skipped (%s)" % (name, e))
+            continue
+
+        results[name] = _time(f, repeat=repeat)
+        print("%-36s %12.3f ms" % (name, 1e3 * results[name]['best']))
+    return results
+
+
+def environment():
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    env = dict(revision=revision, python=platform.python_version(),
+               numpy=np.__version__, machine=platform.machine(),
+               date=datetime.datetime.now().isoformat())
+    for module in ['theano', 'nengo', 'matplotlib']:
+        if module in sys.modules:
+            env[module] = getattr(sys.modules[module], '__version__', None)
+    return env
+
+
+def compare(results, old, threshold=1.2):
+    """Print the change in time for benchmarks in both result sets
+
+    Returns the names of benchmarks slower than `threshold` times the old.
+    Old results of renamed benchmarks are compared under their new names.
+    """
+    old = dict((renamed.get(name, name), result)
+               for name, result in old.items())
+    slower = []
+    print("%-36s %12s %12s %8s" % ("benchmark", "old [ms]", "new [ms]",
+                                   "ratio"))
+    for name, result in results.items():
+        if 'best' not in result or 'best' not in old.get(name, {}):
+            continue
+        ratio = result['best'] / old[name]['best']
+        flag = ''
+        if ratio > threshold:
+            slower.append(name)
+            flag = 'SLOWER'
+        print("%-36s %12.3f %12.3f %7.2fx %s" % (
+            name, 1e3 * old[name]['best'], 1e3 * result['best'], ratio, flag))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run micro-benchmarks of the hot kernels")
+    parser.add_argument('--filter', nargs='+', default=None,
+                        help="Only run benchmarks with names containing "
+                        "one of these strings")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Number of timing repeats per benchmark")
+    parser.add_argument('--output', default='benchmarks.json',
+                        help="Where to write the results")
+    parser.add_argument('--compare', default=None,
+                        help="Results file of another revision to compare "
+                        "against")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Slowdown ratio counted as a regression")
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+    np.seterr(all='ignore')  # the neuron kernels overflow harmlessly
+
+    results = run(names=args.filter, repeat=args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(dict(environment=environment(), results=results), f,
+                  indent=1)
+    print("Wrote results to '%s'" % args.output)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)['results']
+        slower = compare(results, old, threshold=args.threshold)
+        if len(slower) > 0:
+            print("%d benchmarks regressed: %s" % (
+                len(slower), ', '.join(slower)))
+            sys.exit(1)
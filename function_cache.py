@@ -0,0 +1,199 @@
+"""
+Persistent cache of compiled Theano functions.
+
+Compiling the training graphs takes much of a short run. Compiled functions
+are pickled, keyed by the structure of their graph (ops, types, constants
+such as sparsity masks, shared variable shapes, floatX and the Theano
+version), and reused by later runs with the shared variables of the current
+graph swapped in. Shared values (weights, datasets) are not stored.
+"""
+from __future__ import print_function
+
+import cPickle as pickle
+import hashlib
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+import theano
+from theano.compile.pfunc import rebuild_collect_shared
+
+import profiling
+
+cache_dir = 'function_cache'
+enabled = os.environ.get('FUNCTION_CACHE', '1') != '0'
+
+stats = dict(compiled=0, compile_time=0., loaded=0, load_time=0.,
+             saved_time=0.)
+
+
+def _pairs(d):
+    if d is None:
+        return []
+    return list(d.items()) if isinstance(d, dict) else list(d)
+
+
+def _shared_inputs(inputs, outputs, updates, givens):
+    """Shared variables of the graph, in the order `theano.function` uses"""
+    outputs = outputs if isinstance(outputs, (list, tuple)) else [outputs]
+    return rebuild_collect_shared(
+        outputs, inputs=inputs, replace=givens, updates=updates)[2][3]
+
+
+def _key(inputs, outputs, updates, givens, shared):
+    outputs = outputs if isinstance(outputs, (list, tuple)) else [outputs]
+    variables = (list(outputs) + [v for _, v in updates] +
+                 [v for _, v in givens])
+
+    h = hashlib.sha1()
+    h.update(theano.printing.debugprint(
+        variables, file='str', print_type=True))
+    for x, y in updates + givens:
+        h.update('%s:%s -> %s:%s' % (x.name, x.type, y.name, y.type))
+    for x in inputs:
+        h.update('input %s:%s' % (x.name, x.type))
+    for s in shared:
+        h.update('shared %s:%s:%s' % (
+            s.name, s.type, np.shape(s.get_value(borrow=True))))
+    for v in theano.gof.graph.ancestors(variables):
+        if isinstance(v, theano.gof.Constant):
+            h.update(np.ascontiguousarray(v.data).tobytes())
+    h.update('%s %s %s %s' % (theano.__version__, theano.config.floatX,
+                               theano.config.device, theano.config.mode))
+    return h.hexdigest()
+
+
+def _placeholder(s):
+    """Empty shared variable of the same type as `s`"""
+    return theano.shared(np.zeros((0,) * s.ndim, dtype=s.dtype),
+                         name=s.name, broadcastable=s.broadcastable)
+
+
+def _copy(fn, swap):
+    """`fn.copy(swap=swap)`, keeping the order of in-place operations
+
+    `Function.copy` drops the graph's DestroyHandler, so the copy may run an
+    in-place op before the other clients of its input (as in the MRG normal
+    samples used for noise). The handler is put back and the copy relinked.
+    """
+    fn = fn.copy(swap=swap)
+    fgraph = fn.maker.fgraph
+    if not hasattr(fgraph, 'destroyers'):
+        fgraph.attach_feature(theano.gof.DestroyHandler())
+        fn = fn.maker.create([i.value for i in fn.maker.inputs])
+    return fn
+
+
+def _load(path, shared):
+    with open(path, 'rb') as f:
+        fn, placeholders, compile_time = pickle.load(f)
+    return _copy(fn, dict(zip(placeholders, shared))), compile_time
+
+
+def _save(path, fn, shared, compile_time):
+    placeholders = [_placeholder(s) for s in shared]
+    fn = _copy(fn, dict(zip(shared, placeholders)))
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    tmp = path + '.%d.tmp' % os.getpid()
+    with open(tmp, 'wb') as f:
+        pickle.dump((fn, placeholders, compile_time), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, path)
+
+
+def function(inputs, outputs, updates=None, givens=None, name=None):
+    """Drop-in for `theano.function` that reuses compiled functions"""
+    updates, givens = _pairs(updates), _pairs(givens)
+    if not enabled:
+        return theano.function(inputs, outputs, updates=updates,
+                               givens=givens, name=name)
+
+    shared = _shared_inputs(inputs, outputs, updates, givens)
+    path = os.path.join(
+        cache_dir, _key(inputs, outputs, updates, givens, shared) + '.pkl')
+
+    if os.path.exists(path):
+        timer = time.time()
+        try:
+            fn, compile_time = _load(path, shared)
+        except Exception as e:
+            warnings.warn("Recompiling: cannot load '%s' (%s)" % (path, e))
+        else:
+            # `copy` always returns a list of outputs
+            fn.unpack_single = not isinstance(outputs, (list, tuple))
+            load_time = time.time() - timer
+            stats['loaded'] += 1
+            stats['load_time'] += load_time
+            stats['saved_time'] += compile_time - load_time
+            profiling.add_time('compile.load_cached', load_time)
+            return fn
+
+    timer = time.time()
+    fn = theano.function(inputs, outputs, updates=updates, givens=givens,
+                         name=name)
+    compile_time = time.time() - timer
+    profiling.add_time('compile', compile_time)
+    stats['compiled'] += 1
+    stats['compile_time'] += compile_time
+
+    try:
+        _save(path, fn, shared, compile_time)
+    except Exception as e:
+        warnings.warn("Cannot cache compiled function (%s)" % e)
+    return fn
+
+
+def test_function_cache():
+    """Check a cached function against a freshly compiled one"""
+    import shutil
+    import tempfile
+    import theano.tensor as tt
+    from theano.sandbox.rng_mrg import MRG_RandomStreams
+
+    global cache_dir, enabled
+    old_dir, old_enabled = cache_dir, enabled
+    cache_dir, enabled = tempfile.mkdtemp(), True
+    floatX = theano.config.floatX
+    rng = np.random.RandomState(10)
+    W0 = rng.normal(size=(20, 5)).astype(floatX)
+    images = rng.normal(size=(30, 20)).astype(floatX)
+
+    def graph():
+        W = theano.shared(W0.copy(), name='W')
+        data = theano.shared(images, name='data')
+        index = tt.lscalar('index')
+        x = tt.matrix('x')
+        xn = x + MRG_RandomStreams(3).normal(size=x.shape, dtype=floatX)
+        cost = tt.sum(tt.dot(xn, W)**2)
+        updates = [(W, W - tt.cast(0.001, floatX) * tt.grad(cost, W))]
+        givens = [(x, data[index * 10:(index + 1) * 10])]
+        return W, data, [index], cost, updates, givens
+
+    try:
+        results = []
+        for make in [theano.function, function, function]:
+            W, data, inputs, cost, updates, givens = graph()
+            fn = make(inputs, cost, updates=updates, givens=givens)
+            data.set_value(images[::-1])  # the function must use this value
+            costs = [fn(i) for i in range(3)]
+            results.append((costs, W.get_value()))
+        assert stats['compiled'] >= 1 and stats['loaded'] >= 1
+
+        (costs, W), cached = results[0], results[1:]
+        for c, w in cached:
+            assert np.allclose(c, costs) and np.allclose(w, W)
+    finally:
+        shutil.rmtree(cache_dir)
+        cache_dir, enabled = old_dir, old_enabled
+
+
+def report():
+    print("Compiled %d functions in %0.1f s; loaded %d cached functions in "
+          "%0.1f s, saving %0.1f s" % (
+              stats['compiled'], stats['compile_time'], stats['loaded'],
+              stats['load_time'], stats['saved_time']))
@@ -0,0 +1,232 @@
+"""
+Static inference with trained networks, using only NumPy.
+
+Loads params files and runs the static (rate) network, without importing
+Nengo, Theano, Scipy or Matplotlib, so that scripts which only classify
+images start quickly. The training and simulation modules re-export the
+functions defined here.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import urllib
+
+import numpy as np
+
+import mnist
+
+urls = {
+    'lif-111-error.npz': 'http://files.figshare.com/2106879/lif_111_error.npz',
+    'lif-126-error.npz': 'http://files.figshare.com/2106875/lif_126_error.npz',
+}
+
+default_neuron = ('softlif', dict(sigma=0.01, tau_rc=0.02, tau_ref=0.002,
+                                  gain=1, bias=1, amp=1. / 63.04))
+
+
+def is_params(keys):
+    """Whether a file with these keys holds (possibly quantized) params"""
+    return (all(k in keys for k in ['weights', 'biases', 'Wc', 'bc']) or
+            all(k in keys for k in ['qweights', 'wscales', 'qWc', 'cscale']))
+
+
+def load_params(loadfile):
+    """Load a params file, fetching the pretrained ones if necessary
+
+    Quantized params files (see `quantize.py`) are loaded as equivalent
+    floating-point params.
+    """
+    if not os.path.exists(loadfile) and loadfile in urls:
+        urllib.urlretrieve(urls[loadfile], loadfile)
+        print("Fetched '%s' to '%s'" % (urls[loadfile], loadfile))
+
+    if not os.path.exists(loadfile):
+        raise ValueError("Cannot find or download '%s'" % loadfile)
+
+    with np.load(loadfile) as data:
+        if 'qweights' not in data:
+            params = dict((k, data[k])
+                          for k in ['weights', 'biases', 'Wc', 'bc'])
+            params['neuron'] = (data['neuron'] if 'neuron' in data
+                                else default_neuron)
+            for k in ['image_mean', 'image_std']:
+                if k in data:
+                    params[k] = data[k]
+            return params
+
+    import quantize
+    return quantize.dequantize_params(quantize.load(loadfile))
+
+
+def softrelu(x, sigma=1.):
+    y = x / sigma
+    z = np.array(x)
+    z[y < 34.0] = sigma * np.log1p(np.exp(y[y < 34.0]))
+    # ^ 34.0 gives exact answer in 32 or 64 bit but doesn't overflow in 32 bit
+    return z
+
+
+def lif_j(j, tau_rc, tau_ref, amp):
+    r = np.zeros_like(j)
+    r[j > 0] = amp / (tau_ref + tau_rc * np.log1p(1. / j[j > 0]))
+    return r
+
+
+def lif(x, tau_rc, tau_ref, gain, bias, amp):
+    return lif_j(gain * x + bias - 1, tau_rc, tau_ref, amp)
+
+
+def softlif(x, sigma, tau_rc, tau_ref, gain, bias, amp):
+    j = softrelu(gain * x + bias - 1, sigma=sigma)
+    return lif_j(j, tau_rc, tau_ref, amp)
+
+
+def get_numpy_fn(kind, params):
+    keys = ['tau_rc', 'tau_ref', 'gain', 'bias', 'amp']
+    if kind == 'lif':
+        kwargs = dict((k, params[k]) for k in keys)
+        return lambda x: lif(x, **kwargs)
+    elif kind == 'softlif':
+        kwargs = dict((k, params[k]) for k in keys + ['sigma'])
+        return lambda x: softlif(x, **kwargs)
+    else:
+        raise ValueError("Unknown neuron type '%s'" % kind)
+
+
+def static_variants(params):
+    """The ('softlif', params) and ('lif', params) pair used for testing
+
+    `params` are the parameters of the trained neuron, which may or may not
+    include the softlif smoothing `sigma`.
+    """
+    lif_params = dict(params)
+    sigma = lif_params.pop('sigma', 0.01)
+    return [('softlif', dict(lif_params, sigma=sigma)), ('lif', lif_params)]
+
+
+def propup(params, images, neuron):
+    """Layer activities, codes and classifier outputs of the static network"""
+    weights = params['weights']
+    biases = params['biases']
+    Wc = params['Wc']
+    bc = params['bc']
+
+    neuron_name, neuron_params = neuron
+    neuron_fn = get_numpy_fn(neuron_name, neuron_params)
+
+    x = images
+    layers = []
+    for w, b in zip(weights, biases):
+        x = neuron_fn(np.dot(x, w) + b)
+        layers.append(x)
+
+    yc = np.dot(x, Wc) + bc
+    return layers, x, yc
+
+
+class StaticModel(object):
+    """Static network with its weights prepared for repeated batches
+
+    `classes` are the labels of the classifier outputs (by default their
+    indices, as trained by `DeepAutoencoder.train_classifier`).
+    """
+
+    def __init__(self, params, neuron, stats=None, dtype='float32',
+                 classes=None):
+        contiguous = lambda x: np.ascontiguousarray(x, dtype=dtype)
+        self.params = dict(
+            weights=[contiguous(w) for w in params['weights']],
+            biases=[contiguous(b) for b in params['biases']],
+            Wc=contiguous(params['Wc']), bc=contiguous(params['bc']))
+        self.neuron = neuron
+        self.stats = stats
+        self.dtype = dtype
+        self.n_pixels = self.params['weights'][0].shape[0]
+        self.classes = (np.arange(self.params['bc'].size) if classes is None
+                        else np.asarray(classes))
+
+    def predict(self, images):
+        """Labels and classifier outputs for raw images in [0, 1]"""
+        if self.stats is not None:
+            x = mnist.normalize_images(images, *self.stats)
+        else:
+            x = np.asarray(images, dtype=self.dtype)
+        _, _, yc = propup(self.params, x, self.neuron)
+        return self.classes[np.argmax(yc, axis=1)], yc
+
+
+def load_model(loadfile, neuron='lif', dtype='float32', spaun=False,
+               classes=None):
+    """`StaticModel` of a params file, normalizing as it was trained
+
+    Params files without stored statistics are normalized with those of the
+    training set, augmented for Spaun if `spaun` (as trained with
+    `train.py --spaun`).
+    """
+    params = load_params(loadfile)
+    variants = dict(static_variants(params['neuron'][1]))
+    stats = mnist.params_stats(params)
+    if stats is None:
+        stats = mnist.normalization(spaun=spaun)
+    return StaticModel(params, (neuron, variants[neuron]), stats=stats,
+                       dtype=dtype, classes=classes)
+
+
+def test_get_numpy_fn():
+    """Check the kernels against the Nengo rate neurons they replace"""
+    import nengo
+    import neurons
+
+    params = dict(tau_rc=0.02, tau_ref=0.002, gain=1.5, bias=1,
+                  amp=1. / 63.04)
+    x = np.linspace(-2, 2, 1001)
+
+    lif_rate = nengo.LIFRate(tau_rc=params['tau_rc'],
+                             tau_ref=params['tau_ref'])
+    y = lif_rate.rates(x, params['gain'], params['bias']) * params['amp']
+    assert np.allclose(get_numpy_fn('lif', params)(x), y)
+
+    softlif_rate = neurons.SoftLIFRate(
+        sigma=0.01, tau_rc=params['tau_rc'], tau_ref=params['tau_ref'])
+    y = softlif_rate.rates(x, params['gain'], params['bias']) * params['amp']
+    assert np.allclose(get_numpy_fn('softlif', dict(params, sigma=0.01))(x), y)
+
+
+
+def test_static_model():
+    rng = np.random.RandomState(5)
+    sizes = [20, 15, 3]
+    params = dict(weights=[rng.normal(size=sizes[:2])], biases=[rng.rand(15)],
+                  Wc=rng.normal(size=sizes[1:]), bc=np.zeros(3))
+    neuron = static_variants(dict(
+        tau_rc=0.02, tau_ref=0.002, gain=1, bias=1, amp=1. / 63.04))[1]
+    classes = np.array([2, 5, 7])
+    model = StaticModel(params, neuron, dtype='float64', classes=classes)
+
+    images = rng.rand(50, 20)
+    labels, yc = model.predict(images)
+    _, _, yc_ref = propup(params, images, neuron)
+    assert np.allclose(yc, yc_ref)
+    assert np.array_equal(labels, classes[np.argmax(yc_ref, axis=1)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Static error of a trained network on the test set")
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        default='float64', help="Precision of the network")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('loadfile', help="Parameter file to evaluate")
+    args = parser.parse_args()
+
+    params = load_params(args.loadfile)
+    _, _, [images, labels] = mnist.load(
+        normalize=True, spaun=args.spaun, stats=mnist.params_stats(params))
+    for neuron in static_variants(params['neuron'][1]):
+        model = StaticModel(params, neuron, dtype=args.dtype,
+                            classes=np.unique(labels))
+        predicted, _ = model.predict(images)
+        print("%s error: %0.2f%%" % (
+            neuron[0], 100 * np.mean(predicted != labels)))
@@ -0,0 +1,59 @@
+"""
+Numpy parts of the autoencoder and RBM layers: receptive-field masks and
+saving layers to file. Imports neither Theano nor Nengo.
+"""
+import numpy as np
+
+
+def rms(x, **kwargs):
+    return np.sqrt((x**2).mean(**kwargs))
+
+
+def sparse_mask(vis_shape, n_hid, rf_shape, rng=np.random, indices=False):
+    """Mask of random `rf_shape` receptive fields, of shape (n_vis, n_hid)
+
+    With `indices=True`, returns the visible and hidden indices of the
+    nonzero elements instead, ordered by hidden unit (as in `W.T[mask.T]`),
+    without allocating the dense mask.
+    """
+    assert len(vis_shape) == 2 and len(rf_shape) == 2
+    M, N = vis_shape
+    m, n = rf_shape
+    n_vis = M * N
+
+    # find random positions for top-left corner of each RF
+    i = rng.randint(low=0, high=M-m+1, size=n_hid)
+    j = rng.randint(low=0, high=N-n+1, size=n_hid)
+
+    # visible index of every RF element, shape (n_hid, m, n)
+    vis = ((i[:, None, None] + np.arange(m)[:, None]) * N +
+           (j[:, None, None] + np.arange(n)))
+    vis = vis.ravel()
+    hid = np.arange(n_hid).repeat(m * n)
+    if indices:
+        return vis, hid
+
+    mask = np.zeros((n_vis, n_hid), dtype='bool')
+    mask[vis, hid] = True
+    return mask
+
+
+class FileObject(object):
+    """
+    A object that can be saved to file
+    """
+    def to_file(self, file_name):
+        d = {}
+        d['__class__'] = self.__class__
+        d['__dict__'] = self.__getstate__()
+        np.savez(file_name, **d)
+
+    @staticmethod
+    def from_file(file_name):
+        npzfile = np.load(file_name)
+        cls = npzfile['__class__'].item()
+        d = npzfile['__dict__'].item()
+
+        self = cls.__new__(cls)
+        self.__setstate__(d)
+        return self
@@ -1,17 +1,24 @@
 import cPickle as pickle
 import gzip
+import hashlib
 import os
 import urllib
 
 import numpy as np
 
+import profiling
+
 urls = {
     'mnist.pkl.gz': 'http://deeplearning.net/data/mnist/mnist.pkl.gz',
     'spaun_sym.pkl.gz': 'http://files.figshare.com/2106874/spaun_sym.pkl.gz',
 }
 
+spaun_ratio = 0.2  # Spaun examples per label, relative to MNIST examples
 
-def read_file(filepath):
+_file_hashes = {}
+
+
+def _fetch(filepath):
     if not os.path.exists(filepath):
         if filepath in urls:
             urllib.urlretrieve(urls[filepath], filename=filepath)
@@ -20,42 +27,418 @@ def read_file(filepath):
             raise NotImplementedError(
                 "I do not know where to find '%s'" % filepath)
 
+
+def _file_hash(filepath):
+    """SHA-1 of a data file (fetched if necessary), computed once per version"""
+    _fetch(filepath)
+    st = os.stat(filepath)
+    key = (os.path.abspath(filepath), st.st_size, st.st_mtime)
+    if key not in _file_hashes:
+        h = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+def read_file(filepath):
+    _fetch(filepath)
     with gzip.open(filepath, 'rb') as f:
         train, valid, test = pickle.load(f)
 
     return train, valid, test
 
 
-def load(normalize=False, shuffle=False, spaun=False, seed=8):
-    sets = read_file('mnist.pkl.gz')
+def _prototypes(n_variants=10, shape=(28, 28), n_points=4, sigma=1.2,
+                seed=0):
+    """Stroke images of each class, with `n_variants` variations per class
+
+    Each class is a polyline through `n_points` random control points, and
+    each variant jitters these points. Returns an array of shape
+    (10, n_variants) + shape.
+    """
+    rng = np.random.RandomState(seed)
+    rows, cols = np.mgrid[:shape[0], :shape[1]]
+    margin = 6
+
+    protos = np.zeros((10, n_variants) + shape, dtype='float32')
+    for c in range(10):
+        base = rng.uniform(margin, shape[0] - margin, size=(n_points, 2))
+        for v in range(n_variants):
+            points = base + rng.normal(scale=1.5, size=base.shape)
+            s = np.linspace(0, 1, 30)[:, None, None]
+            path = (points[:-1] + s * (points[1:] - points[:-1])).reshape(-1, 2)
+            d2 = ((rows[..., None] - path[:, 0])**2 +
+                  (cols[..., None] - path[:, 1])**2)
+            protos[c, v] = np.exp(-d2.min(axis=-1) / (2 * sigma**2))
+    return protos
+
+
+def _check_size(n, shape, dtype, copies=1):
+    """Raise if `copies` of `n` images would not fit in physical memory"""
+    nbytes = copies * n * int(np.prod(shape)) * np.dtype(dtype).itemsize
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return  # unknown on this platform
+
+    if nbytes > memory:
+        raise MemoryError(
+            "%d synthetic images as %s (%d cop%s) need %0.1f GB, more than "
+            "the %0.1f GB of physical memory%s" % (
+                n, np.dtype(dtype), copies, 'y' if copies == 1 else 'ies',
+                nbytes / 1e9, memory / 1e9,
+                "" if np.dtype(dtype) == np.uint8 else
+                " (compact sets are uint8, a quarter of the size)"))
+
+
+def synthetic_images(n, seed=0, split=0, shape=(28, 28), chunk_size=10000,
+                     dtype='float32'):
+    """Deterministic MNIST-like images and labels of `n` examples
+
+    Images are class prototypes (see `_prototypes`), randomly shifted by up
+    to two pixels, scaled and with added noise, as float32 in [0, 1], or
+    with `dtype='uint8'` as steps of 1/255 (see `quantize`), a quarter of
+    the memory. Only one chunk of `chunk_size` examples is held as floats
+    at a time. All splits with the same `seed` share prototypes. Examples
+    are generated in chunks with their own seeds, so the first examples are
+    the same for any `n`. Raises `MemoryError` up front if the images would
+    not fit in physical memory.
+    """
+    _check_size(n, shape, dtype)
+    protos = _prototypes(shape=shape, seed=seed)
+    n_variants = protos.shape[1]
+    r = 2
+    padded = np.pad(protos, [(0, 0), (0, 0), (r, r), (r, r)], 'constant')
+
+    images = np.zeros((n, np.prod(shape)), dtype=dtype)
+    labels = np.zeros(n, dtype='int64')
+    for k, start in enumerate(range(0, n, chunk_size)):
+        rng = np.random.RandomState([seed, split, k])
+        m = chunk_size  # draw for a whole chunk, so chunks don't depend on n
+        y = rng.randint(10, size=m)
+        v = rng.randint(n_variants, size=m)
+        dy, dx = rng.randint(2 * r + 1, size=(2, m))
+        gain = rng.uniform(0.7, 1.0, size=(m, 1, 1)).astype('float32')
+
+        m = min(chunk_size, n - start)  # but only render the rows needed
+        i = (dy[:m, None] + np.arange(shape[0]))[:, :, None]
+        j = (dx[:m, None] + np.arange(shape[1]))[:, None, :]
+        x = padded[y[:m, None, None], v[:m, None, None], i, j]
+        x *= gain[:m]
+        x += rng.normal(scale=0.05, size=x.shape).astype('float32')
+
+        x = x.reshape(m, -1)
+        images[start:start + m] = (quantize(x, 1. / 255)[0]
+                                   if images.dtype == np.uint8 else
+                                   np.clip(x, 0, 1))
+        labels[start:start + m] = y[:m]
+    return images, labels
+
+
+def synthetic_sets(n, seed=0, dtype='float32'):
+    """Synthetic `(train, valid, test)` sets of `n` examples in total
+
+    The sets are split in the proportions of MNIST (5:1:1).
+    """
+    _check_size(n, (28, 28), dtype)
+    n_valid = n_test = n // 7
+    n_train = n - n_valid - n_test
+    return tuple(synthetic_images(m, seed=seed, split=i, dtype=dtype)
+                 for i, m in enumerate([n_train, n_valid, n_test]))
+
+
+def quantize(images, scale=None):
+    """Images in [0, 1] as uint8 steps of `scale`
+
+    The default scale is 1/256 if that is exact (as for MNIST), else 1/255.
+    Returns the uint8 images and the scale.
+    """
+    if scale is None:
+        scale = 1. / 255
+        if images.max() < 1 and np.array_equal(
+                np.round(images * 256), images * 256):
+            scale = 1. / 256
+    steps = np.round(np.clip(images, 0, 1) / scale)
+    return np.minimum(steps, 255).astype('uint8'), scale
+
+
+class ImageView(object):
+    """Rows of base images, gathered and normalized only when indexed
+
+    `base` holds the raw images (float, or uint8 steps of `scale`; see
+    `quantize`), and `index` selects and orders its rows. Index entries past
+    the end of `base` refer to the rows of `extra` (e.g. the Spaun symbols),
+    cycling through them, so repeated rows are never stored. Indexing
+    returns float32 rows normalized with the per-pixel `mean` and `std` (in
+    units of the original images), so only the rows of a batch are ever
+    held as floats, and shuffling only permutes the index.
+    """
+    dtype = np.dtype('float32')
+
+    def __init__(self, base, index=None, extra=None, scale=1.,
+                 mean=None, std=None):
+        assert base.ndim == 2
+        assert extra is None or extra.dtype == base.dtype
+        self.base = base
+        self.index = index
+        self.extra = extra
+        self.scale = scale
+        self.set_stats(mean, std)
+
+    def set_stats(self, mean=None, std=None):
+        """Normalize rows as `(x - mean) / std` from now on"""
+        self.mean, self.std = mean, std
+        n_pixels = self.base.shape[1]
+        if mean is None:
+            self.pixel_scale = np.float32(self.scale) * np.ones(n_pixels, 'float32')
+            self.pixel_offset = np.zeros(n_pixels, dtype='float32')
+        else:
+            self.pixel_scale = (self.scale / std).astype('float32')
+            self.pixel_offset = (-mean / std).astype('float32')
+
+    def take(self, index):
+        """View of the rows `index` of this view, sharing its images"""
+        index = np.asarray(index)
+        if self.index is not None:
+            index = self.index[index]
+        return ImageView(self.base, index=index, extra=self.extra,
+                         scale=self.scale, mean=self.mean, std=self.std)
+
+    def shuffle(self, rng=np.random):
+        """View of the rows in random order (costs an index, not a copy)"""
+        return self.take(rng.permutation(len(self)))
+
+    def raw(self, key=slice(None)):
+        """Raw (unnormalized) rows `key` of the view"""
+        if self.index is None:
+            return self.base[key]
+
+        i = self.index[key]
+        if self.extra is None:
+            return self.base[i]
+
+        n = len(self.base)
+        if np.ndim(i) == 0:
+            return self.base[i] if i < n else self.extra[(i - n) % len(self.extra)]
+
+        rows = np.empty((len(i),) + self.base.shape[1:], dtype=self.base.dtype)
+        is_base = i < n
+        rows[is_base] = self.base[i[is_base]]
+        rows[~is_base] = self.extra[(i[~is_base] - n) % len(self.extra)]
+        return rows
+
+    @property
+    def data(self):
+        """Raw rows of the whole view (the base itself, if not indexed)"""
+        return self.raw()
+
+    def pixel_stats(self, chunk_size=10000):
+        """Per-pixel mean and standard deviation, without a float copy"""
+        s = np.zeros(self.base.shape[1])
+        s2 = np.zeros(self.base.shape[1])
+        for start in range(0, len(self), chunk_size):
+            x = self.raw(slice(start, start + chunk_size)).astype('float64')
+            s += x.sum(axis=0)
+            s2 += (x**2).sum(axis=0)
+        mean = s / len(self)
+        std = np.sqrt(np.maximum(s2 / len(self) - mean**2, 0))
+        return self.scale * mean, self.scale * std
+
+    def __getitem__(self, key):
+        return self.raw(key) * self.pixel_scale + self.pixel_offset
+
+    def __len__(self):
+        return len(self.base) if self.index is None else len(self.index)
+
+    @property
+    def shape(self):
+        return (len(self),) + self.base.shape[1:]
+
+    @property
+    def ndim(self):
+        return self.base.ndim
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        """Memory held by this view, not counting a shared base"""
+        return sum(x.nbytes for x in [self.index, self.extra,
+                                      self.pixel_scale, self.pixel_offset]
+                   if x is not None)
+
+    def astype(self, dtype, copy=True):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.astype(dtype if dtype is not None else self.dtype)
+
+
+def fit_normalization(images, min_std=3e-1):
+    """Per-pixel mean and (bounded) standard deviation to normalize with"""
+    if not isinstance(images, ImageView):
+        images = ImageView(images)
+    mean, std = images.pixel_stats()
+    return mean, np.maximum(std, min_std)
+
+
+def normalize_images(images, mean, std):
+    """Raw images in [0, 1] normalized with stored statistics"""
+    scale = (1. / std).astype('float32')
+    offset = (-mean / std).astype('float32')
+    out = np.multiply(images, scale, dtype='float32')
+    out += offset
+    return out
+
+
+def _synthetic_size(synthetic):
+    if synthetic is None and os.environ.get('MNIST_SYNTHETIC'):
+        return int(os.environ['MNIST_SYNTHETIC'])
+    return synthetic
+
+
+def _stats_file(spaun, synthetic, seed):
+    """Cache file of the training statistics, keyed on the source data
+
+    The key hashes the data files (or the size of the synthetic sets), the
+    Spaun augmentation ratio and the shuffling seed, so that changing any of
+    them fits new statistics.
+    """
+    h = hashlib.sha1()
+    if synthetic is None:
+        h.update('mnist.pkl.gz %s' % _file_hash('mnist.pkl.gz'))
+    else:
+        h.update('synthetic %d' % synthetic)
+    if spaun:
+        h.update('spaun_sym.pkl.gz %s ratio %r' % (
+            _file_hash('spaun_sym.pkl.gz'), spaun_ratio))
+    h.update('seed %d' % seed)
+
+    name = 'mnist' if synthetic is None else 'synthetic%d' % synthetic
+    return '%s%s_norm_%s.npz' % (
+        name, '_spaun' if spaun else '', h.hexdigest()[:12])
+
+
+def train_stats(images, spaun=False, synthetic=None, seed=8):
+    """Normalization statistics of the training set, fitted once
+
+    The statistics are cached in a file named after the dataset and keyed
+    on its source (see `_stats_file`), and fitted on `images` (the training
+    images, as loaded with these arguments) only if not cached.
+    """
+    path = _stats_file(spaun, _synthetic_size(synthetic), seed)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return data['mean'], data['std']
+
+    mean, std = fit_normalization(images)
+    np.savez(path, mean=mean, std=std)
+    return mean, std
+
+
+def params_stats(params):
+    """Normalization statistics stored with a network, or None
+
+    `params` is a params dictionary or loaded params file, as saved by
+    `train.py` (with `image_mean` and `image_std`).
+    """
+    if 'image_mean' in params and 'image_std' in params:
+        return params['image_mean'], params['image_std']
+    return None
+
+
+def normalization(spaun=False, synthetic=None, seed=8):
+    """Cached normalization statistics of the training set (see `load`)"""
+    path = _stats_file(spaun, _synthetic_size(synthetic), seed)
+    if not os.path.exists(path):
+        load(normalize=True, spaun=spaun, seed=seed, synthetic=synthetic,
+             lazy=True)
+    return train_stats(None, spaun=spaun, synthetic=synthetic, seed=seed)
+
+
+@profiling.timed('data.load')
+def load(normalize=False, shuffle=False, spaun=False, seed=8, synthetic=None,
+         compact=False, lazy=False, stats=None):
+    """Load MNIST as `(train, valid, test)` sets of images and labels
+
+    With `synthetic=N` (or the `MNIST_SYNTHETIC=N` environment variable),
+    the sets are `N` synthetic examples instead (see `synthetic_sets`),
+    which needs neither the network nor the MNIST file.
+
+    With `normalize`, all sets are normalized with the `(mean, std)`
+    statistics `stats` (e.g. those stored with a trained network), or by
+    default with those of the training set (see `train_stats`).
+
+    Shuffling and Spaun augmentation (which always shuffles) only build
+    indices into the loaded images. With `lazy` or `compact`, the images
+    are returned as `ImageView`s, which gather and normalize rows only
+    when indexed (`compact` keeps the pixels as uint8, a quarter of the
+    memory); otherwise they are gathered into float32 arrays.
+    """
+    synthetic = _synthetic_size(synthetic)
+    if synthetic is not None:
+        # eager float sets are generated, then gathered into a second copy
+        _check_size(synthetic, (28, 28), 'uint8' if compact else 'float32',
+                    copies=1 if lazy or compact else 2)
+        sets = synthetic_sets(synthetic, dtype='uint8' if compact else 'float32')
+    else:
+        sets = read_file('mnist.pkl.gz')
+
+    views = []
+    for images, labels in sets:
+        scale = 1.
+        if images.dtype == np.uint8:
+            scale = 1. / 255  # generated compact
+        elif compact:
+            images, scale = quantize(images)
+        views.append((ImageView(images, scale=scale), labels))
 
     if spaun:
-        sets = _augment(*sets)
+        views = _augment(*views)
 
-    if shuffle or augment:  # always shuffle on augment
+    if shuffle or spaun:  # always shuffle on augment
         rng = np.random.RandomState(seed)
-        sets = tuple(_shuffle(*s, rng=rng) for s in sets)
+        views = [_shuffle(*v, rng=rng) for v in views]
 
     if normalize:
-        for images, labels in sets:
-            _normalize(images)
+        if stats is None:
+            stats = train_stats(views[0][0], spaun=spaun, synthetic=synthetic,
+                                seed=seed)
+        for images, labels in views:
+            images.set_stats(*stats)
+
+    if not (lazy or compact):
+        views = [(images[:], labels) for images, labels in views]
 
-    return sets
+    return tuple(views)
 
 
-def _augment(train, valid, test, ratio=0.2):
+def _augment(train, valid, test, ratio=spaun_ratio):
+    """Add virtual copies of the Spaun symbols to each set of views"""
     atrain, _, _ = read_file('spaun_sym.pkl.gz')  # 'valid' and 'test' == 'train'
     x, y = atrain[0][10:], atrain[1][10:]
 
     def aug(data, ratio):
         images, labels = data
-        n = images.shape[0] / 10  # approximate examples per label
-        na = int(n * ratio)       # examples per augmented category
+        n = images.shape[0] // 10  # approximate examples per label
+        na = int(n * ratio)        # examples per augmented category
 
-        xx = np.vstack([images, np.tile(x, (na, 1))])
-        yy = np.hstack([labels, np.tile(y, na)])
+        if images.base.dtype == np.uint8:
+            extra, _ = quantize(x, images.scale)
+        else:
+            extra = x.astype(images.base.dtype)
+        index = images.index
+        if index is None:
+            index = np.arange(len(images.base))
+        index = np.hstack([index, len(images.base) + np.arange(na * len(x))])
 
-        return xx, yy
+        view = ImageView(images.base, index=index, extra=extra,
+                         scale=images.scale)
+        return view, np.hstack([labels, np.tile(y, na)])
 
     return aug(train, ratio), aug(valid, ratio), aug(test, ratio)
 
@@ -63,13 +446,7 @@ def _augment(train, valid, test, ratio=0.2):
 def _shuffle(images, labels, rng=np.random):
     assert images.shape[0] == labels.shape[0]
     i = rng.permutation(images.shape[0])
-    return images[i], labels[i]
-
-
-def _normalize(images):
-    """Normalize a set of images in-place"""
-    images -= images.mean(axis=0, keepdims=True)
-    images /= np.maximum(images.std(axis=0, keepdims=True), 3e-1)
+    return images.take(i), labels[i]
 
 
 def test_augment():
@@ -78,7 +455,7 @@ def test_augment():
     # atrain, _, _ = load('spaun_sym.pkl.gz')
     # assert len(atrain[0]) == 24
 
-    atrain, _, _ = load(augment=True)
+    atrain, _, _ = load(spaun=True)
 
     plt.figure()
     axes = [plt.subplot(4, 6, i+1) for i in range(24)]
@@ -90,5 +467,17 @@ def test_augment():
     plt.show()
 
 
+
+def test_synthetic_size():
+    try:
+        load(synthetic=10**12, compact=True)
+    except MemoryError:
+        pass
+    else:
+        assert False, "Sets larger than memory should be refused"
+
+    assert synthetic_images(10, dtype='uint8')[0].shape == (10, 784)
+
+
 if __name__ == '__main__':
     test_augment()
@@ -1,24 +1,8 @@
 import nengo
 import numpy as np
 
-
-def softrelu(x, sigma=1.):
-    y = x / sigma
-    z = np.array(x)
-    z[y < 34.0] = sigma * np.log1p(np.exp(y[y < 34.0]))
-    # ^ 34.0 gives exact answer in 32 or 64 bit but doesn't overflow in 32 bit
-    return z
-
-
-def lif_j(j, tau_rc, tau_ref, amp):
-    r = np.zeros_like(j)
-    r[j > 0] = amp / (tau_ref + tau_rc * np.log1p(1. / j[j > 0]))
-    return r
-
-
-def lif(x, tau_rc, tau_ref, gain, bias, amp):
-    j = gain * x + bias - 1
-    return lif_j(gain * x + bias - 1, tau_rc, tau_ref, amp)
+from inference import (  # re-exported, for the training code
+    softrelu, lif_j, lif, softlif, get_numpy_fn, static_variants)
 
 
 def d_lif(x, tau_rc, tau_ref, gain, bias, amp):
@@ -31,11 +15,6 @@ def d_lif(x, tau_rc, tau_ref, gain, bias, amp):
     return d
 
 
-def softlif(x, sigma, tau_rc, tau_ref, gain, bias, amp):
-    j = softrelu(gain * x + bias - 1, sigma=sigma)
-    return lif_j(j, tau_rc, tau_ref, amp)
-
-
 def d_softlif(x, sigma, tau_rc, tau_ref, gain, bias, amp):
     y = gain * x + bias - 1
     j = softrelu(y, sigma=sigma)
@@ -97,20 +76,6 @@ def s_softlif(x, sigma, tau_ref, tau_rc, gain, bias, amp):
     return tt.switch(j > 0, v, 0.0)
 
 
-def get_numpy_fn(kind, params):
-    if kind == 'lif':
-        lif = nengo.LIFRate(tau_rc=params['tau_rc'], tau_ref=params['tau_ref'])
-        return lambda x: (
-            lif.rates(x, params['gain'], params['bias']) * params['amp'])
-    elif kind == 'softlif':
-        softlif = SoftLIFRate(
-            tau_rc=params['tau_rc'], tau_ref=params['tau_ref'], sigma=params['sigma'])
-        return lambda x: (
-            softlif.rates(x, params['gain'], params['bias']) * params['amp'])
-    else:
-        raise ValueError("Unknown neuron type '%s'" % kind)
-
-
 def get_numpy_deriv(kind, params):
     if kind == 'lif':
         return lambda x: d_lif(x, **params)
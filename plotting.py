@@ -7,7 +7,6 @@ import os
 import numpy as np
 import numpy.random as npr
 
-import matplotlib.pyplot as plt
 
 def display_available():
     return ('DISPLAY' in os.environ)
@@ -26,52 +25,67 @@ def show(image, ax=None, vlims=None, invert=False):
     else:
         raise ValueError("Wrong number of image dimensions")
 
-    if ax is None: ax = plt.gca()
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
     ax.imshow(image, **kwargs)
     return ax
 
 
+def _mosaic(images, rows, cols):
+    """Arrange a stack of images (n, m, n[, c]) into a rows x cols mosaic"""
+    n_images, m, n = images.shape[:3]
+    extra = images.shape[3:]
+    if n_images < rows * cols:
+        pad = np.zeros((rows * cols - n_images,) + images.shape[1:],
+                       dtype=images.dtype)
+        images = np.concatenate([images, pad])
+
+    img = images.reshape((rows, cols, m, n) + extra).swapaxes(1, 2)
+    return img.reshape((rows * m, cols * n) + extra)
+
+
+def _grid(ax, shape, row_step, col_step, color='r', linewidth=1):
+    """Draw grid lines between tiles as a single line collection"""
+    from matplotlib.collections import LineCollection
+
+    h, w = shape[:2]
+    ys = np.arange(row_step, h, row_step) - 0.5
+    xs = np.arange(col_step, w, col_step) - 0.5
+    segments = (
+        [[(-0.5, y), (w - 0.5, y)] for y in ys] +
+        [[(x, -0.5), (x, h - 0.5)] for x in xs])
+    ax.add_collection(
+        LineCollection(segments, colors=color, linewidths=linewidth))
+
+    ax.set_xlim([-0.5, w - 0.5])
+    ax.set_ylim([-0.5, h - 0.5])
+    ax.invert_yaxis()
+
+
 def tile(images, ax=None, rows=16, cols=24, random=False,
          grid=False, gridwidth=1, gridcolor='r', **show_params):
     """
     Plot tiled images to the current axis
 
-    :images Each row is one flattened image
+    :images Each row is one image, with shape (m, n) or (m, n, channels)
     """
 
     n_images = images.shape[0]
-    imshape = images.shape[1:]
-    m, n = imshape[:2]
-    n_channels = imshape[2] if len(imshape) > 2 else 1
+    m, n = images.shape[1:3]
 
     inds = np.arange(n_images)
     if random:
         npr.shuffle(inds)
 
-    img_shape = (m*rows, n*cols)
-    if n_channels > 1:
-        img_shape = img_shape + (n_channels,)
-    img = np.zeros(img_shape, dtype=images.dtype)
-    for ind in xrange(min(rows*cols, n_images)):
-        i,j = (ind / cols, ind % cols)
-        img[i*m:(i+1)*m, j*n:(j+1)*n] = images[inds[ind]]
-
+    img = _mosaic(images[inds[:rows*cols]], rows, cols)
 
     ax = show(img, ax=ax, **show_params)
     ax.xaxis.set_visible(False)
     ax.yaxis.set_visible(False)
 
     if grid:
-        for i in xrange(1,rows):
-            ax.plot([-0.5, img.shape[1]-0.5], [i*m-0.5, i*m-0.5], '-',
-                    color=gridcolor, linewidth=gridwidth)
-        for j in xrange(1,cols):
-            ax.plot([j*n-0.5, j*n-0.5], [-0.5, img.shape[0]-0.5], '-',
-                    color=gridcolor, linewidth=gridwidth)
-
-        ax.set_xlim([-0.5, img.shape[1]-0.5])
-        ax.set_ylim([-0.5, img.shape[0]-0.5])
-        ax.invert_yaxis()
+        _grid(ax, img.shape, m, n, color=gridcolor, linewidth=gridwidth)
 
 
 def compare(imagesetlist,
@@ -81,38 +95,29 @@ def compare(imagesetlist,
     n_images = imagesetlist[0].shape[0]
     imshape = imagesetlist[0].shape[1:]
     m, n = imshape[:2]
-    n_channels = imshape[2] if len(imshape) > 2 else 1
 
     inds = np.arange(n_images)
     if random:
         npr.shuffle(inds)
 
-    img_shape = (d*m*rows, n*cols)
-    if n_channels > 1:
-        img_shape = img_shape + (n_channels,)
-    img = np.zeros(img_shape, dtype=imagesetlist[0].dtype)
-
-    for ind in range(min(rows*cols, n_images)):
-        i,j = (ind / cols, ind % cols)
-        for k in xrange(d):
-            img[(d*i+k)*m:(d*i+k+1)*m, j*n:(j+1)*n] = \
-                imagesetlist[k][inds[ind],:].reshape(imshape)
+    # interleave the sets, so each row of tiles is followed by its comparisons
+    inds = inds[:rows*cols]
+    k = len(inds)
+    sets = np.array([s[inds].reshape((k,) + imshape) for s in imagesetlist])
+    sets = np.concatenate([sets, np.zeros(
+        (d, rows*cols - k) + imshape, dtype=sets.dtype)], axis=1)
+    sets = sets.reshape((d, rows, cols) + imshape).swapaxes(0, 1)
+    img = _mosaic(sets.reshape((rows*d*cols,) + imshape), rows*d, cols)
 
     ax = show(img, ax=ax, vlims=vlims)
 
     if grid:
-        for i in xrange(1,rows):
-            ax.plot( [-0.5, img.shape[1]-0.5], (d*i*m-0.5)*np.ones(2), 'r-' )
-        for j in xrange(1,cols):
-            ax.plot( [j*n-0.5, j*n-0.5], [-0.5, img.shape[0]-0.5], 'r-')
-
-        ax.set_xlim([-0.5, img.shape[1]-0.5])
-        ax.set_ylim([-0.5, img.shape[0]-0.5])
-        ax.invert_yaxis()
+        _grid(ax, img.shape, d*m, n)
 
 
 def activations(acts, func, ax=None):
     if ax is None:
+        import matplotlib.pyplot as plt
         ax = plt.gca()
 
     N = acts.size
@@ -130,3 +135,34 @@ def activations(acts, func, ax=None):
 def filters(filters, ax=None, **kwargs):
     std = filters.std()
     tile(filters, ax=ax, vlims=(-2*std, 2*std), grid=True, **kwargs)
+
+
+def benchmark_tile(sizes=(200, 1000, 5000), shape=(28, 28), n_repeats=3):
+    """Time `tile` (with grid) for different numbers of filters"""
+    import timeit
+    import matplotlib.pyplot as plt
+
+    rng = np.random.RandomState(9)
+    results = {}
+    for size in sizes:
+        cols = int(np.ceil(np.sqrt(2 * size)))
+        rows = int(np.ceil(float(size) / cols))
+        filters = rng.normal(size=(size,) + shape)
+
+        fig = plt.figure()
+        def run():
+            fig.clf()
+            filters_ax = fig.add_subplot(111)
+            tile(filters, ax=filters_ax, rows=rows, cols=cols, grid=True)
+            fig.canvas.draw()
+
+        results[size] = min(timeit.repeat(run, number=1, repeat=n_repeats))
+        plt.close(fig)
+        print("tile %5d filters (%dx%d): %0.3f s" % (
+            size, rows, cols, results[size]))
+
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_tile()
@@ -0,0 +1,128 @@
+"""
+Named timers and counters for finding where time goes.
+
+Instrumentation is off by default, and then costs almost nothing. Enable it
+with `enable()` (the `--profile` flag of the scripts) or by setting the
+`PROFILE` environment variable (to anything but '', '0' or 'false'). The
+timers, counters and peak resident memory of the run are then printed and
+saved as JSON when the process exits.
+"""
+from __future__ import print_function
+
+import atexit
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import os
+import resource
+import sys
+import time
+
+enabled = False
+
+_timers = collections.OrderedDict()  # name -> [calls, total, max]
+_counters = collections.OrderedDict()
+
+
+def enable(flag=True):
+    """Turn on profiling (if `flag`), with a report and profile at exit"""
+    global enabled
+    if flag and not enabled:
+        enabled = True
+        atexit.register(_at_exit)
+
+
+def add_time(name, seconds):
+    if not enabled:
+        return
+    entry = _timers.setdefault(name, [0, 0., 0.])
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] = max(entry[2], seconds)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Time the enclosed block under `name`"""
+    if not enabled:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_time(name, time.time() - start)
+
+
+def timed(name):
+    """Decorator timing each call of a function under `name`"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def peak_rss():
+    """Peak resident memory of this process [bytes]"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024 * rss
+
+
+def summary():
+    timers = collections.OrderedDict(
+        (name, dict(calls=calls, total=total, mean=total / calls, max=tmax))
+        for name, [calls, total, tmax] in _timers.items())
+    return dict(argv=sys.argv, timers=timers, counters=dict(_counters),
+                peak_rss=peak_rss())
+
+
+def report():
+    print("%-32s %8s %10s %10s %10s" % (
+        "timer", "calls", "total [s]", "mean [ms]", "max [ms]"))
+    for name, [calls, total, tmax] in _timers.items():
+        print("%-32s %8d %10.3f %10.3f %10.3f" % (
+            name, calls, total, 1e3 * total / calls, 1e3 * tmax))
+    for name, n in _counters.items():
+        print("%-32s %8d" % (name, n))
+    print("Peak RSS: %0.1f MB" % (peak_rss() / 1e6))
+
+
+def save(filename=None):
+    """Write the profile of this run as JSON, if profiling is enabled
+
+    The default name is `profile_<script>_<timestamp>.json`, or the value
+    of `PROFILE` if that ends in `.json`.
+    """
+    if not enabled:
+        return None
+
+    if filename is None:
+        filename = os.environ.get('PROFILE', '')
+    if not filename.endswith('.json'):
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H.%M.%S')
+        filename = 'profile_%s_%s.json' % (script or 'python', timestamp)
+
+    with open(filename, 'w') as f:
+        json.dump(summary(), f, indent=1)
+    print("Saved profile at '%s'" % filename)
+    return filename
+
+
+def _at_exit():
+    report()
+    save()
+
+
+enable(os.environ.get('PROFILE', '').strip().lower() not in ('', '0', 'false'))
@@ -0,0 +1,178 @@
+"""
+Pruning of dead and redundant neurons from trained networks.
+
+Units are profiled through the static network. Units whose mean firing rate
+is below a threshold are removed, with their mean output folded into the
+biases of the units they project to. Units whose incoming weights and bias
+are (nearly) identical compute the same function, so they are merged into
+one unit carrying the sum of their outgoing weights.
+"""
+from __future__ import print_function
+
+import argparse
+
+import numpy as np
+
+import inference
+
+
+def _duplicates(W, b, tol):
+    """Map each unit to the first unit with (nearly) the same inputs
+
+    Units `i` and `j` are duplicates if the distance between their incoming
+    weight-and-bias vectors, relative to the larger of their norms, is
+    below `tol`.
+    """
+    V = np.vstack([W, b[None, :]]).T
+    norms = np.sqrt((V**2).sum(axis=1))
+    d2 = norms[:, None]**2 + norms[None, :]**2 - 2 * np.dot(V, V.T)
+    scale = np.maximum(np.maximum(norms[:, None], norms[None, :]), 1e-12)
+    close = np.sqrt(np.maximum(d2, 0)) / scale < tol
+
+    n = len(norms)
+    target = np.arange(n)
+    for i in range(n):
+        if target[i] != i:
+            continue  # already merged into an earlier unit
+        js = np.flatnonzero(close[i, i+1:]) + i + 1
+        js = js[target[js] == js]
+        target[js] = i
+    return target
+
+
+def prune_params(params, means, min_mean=0., tol=0.):
+    """Remove units with mean activation below `min_mean` and merge duplicates
+
+    Parameters
+    ----------
+    params : dict
+        Network params (`weights`, `biases`, `Wc`, `bc`, and optionally
+        `rec_weights` and `rec_biases`).
+    means : list of arrays
+        Mean activation of each unit in each hidden layer.
+    min_mean : float
+        Units with lower mean activation are removed.
+    tol : float
+        Relative tolerance for merging duplicate units (0 merges none).
+
+    Returns the pruned params and the indices of the units kept per layer.
+    """
+    n_layers = len(params['weights'])
+    weights = [np.array(w) for w in params['weights']]
+    biases = [np.array(b) for b in params['biases']]
+    Wc, bc = np.array(params['Wc']), np.array(params['bc'])
+    has_rec = 'rec_weights' in params and 'rec_biases' in params
+    if has_rec:
+        rec_weights = [np.array(v) for v in params['rec_weights']]
+        rec_biases = [np.array(c) for c in params['rec_biases']]
+
+    kept = []
+    for l in range(n_layers):
+        n = biases[l].size
+        dead = means[l] < min_mean
+        alive = np.flatnonzero(~dead)
+
+        # merge duplicates among the live units
+        target = np.arange(n)
+        if tol > 0 and alive.size > 1:
+            target[alive] = alive[_duplicates(
+                weights[l][:, alive], biases[l][alive], tol)]
+        keep = np.flatnonzero(~dead & (target == np.arange(n)))
+        new_index = np.zeros(n, dtype=int)
+        new_index[keep] = np.arange(keep.size)
+
+        # rewrite everything consuming this layer's output
+        def consume(M, c):
+            c = c + np.dot(means[l][dead], M[dead])
+            M_new = np.zeros((keep.size,) + M.shape[1:], dtype=M.dtype)
+            np.add.at(M_new, new_index[target[alive]], M[alive])
+            return M_new, c
+
+        if l + 1 < n_layers:
+            weights[l+1], biases[l+1] = consume(weights[l+1], biases[l+1])
+        else:
+            Wc, bc = consume(Wc, bc)
+        if has_rec:
+            rec_weights[l], rec_biases[l] = consume(
+                rec_weights[l], rec_biases[l])
+
+        # and everything producing it
+        weights[l], biases[l] = weights[l][:, keep], biases[l][keep]
+        if has_rec and l + 1 < n_layers:
+            rec_weights[l+1] = rec_weights[l+1][:, keep]
+            rec_biases[l+1] = rec_biases[l+1][keep]
+
+        kept.append(keep)
+
+    pruned = dict(params, weights=weights, biases=biases, Wc=Wc, bc=bc)
+    if has_rec:
+        pruned.update(rec_weights=rec_weights, rec_biases=rec_biases)
+    return pruned, kept
+
+
+def _sizes(params):
+    return ([params['weights'][0].shape[0]] +
+            [len(b) for b in params['biases']] + [len(params['bc'])])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Prune dead and duplicate neurons from a trained network")
+    parser.add_argument('--min-rate', type=float, default=1.,
+                        help="Remove neurons firing below this mean rate [Hz]")
+    parser.add_argument('--tol', type=float, default=0.01,
+                        help="Relative tolerance for merging duplicate neurons")
+    parser.add_argument('--n-profile', type=int, default=10000,
+                        help="Number of training images to profile with")
+    parser.add_argument('--no-sim', action='store_true',
+                        help="Do not time the spiking simulation")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('loadfile', help="Parameter file to load")
+    parser.add_argument('savefile', nargs='?', default=None,
+                        help="Where to save the pruned network")
+    args = parser.parse_args()
+
+    import mnist
+    import view
+
+    params = inference.load_params(args.loadfile)
+    neurons_list = inference.static_variants(params['neuron'][1])
+    amp = neurons_list[1][1]['amp']
+
+    [train_images, train_labels], _, [images, labels] = mnist.load(
+        normalize=True, shuffle=True, spaun=args.spaun,
+        stats=mnist.params_stats(params))
+
+    # --- profile LIF activations on (part of) the training set
+    n = args.n_profile
+    profile = view.compute_static_stats(
+        params, train_images[:n], train_labels[:n], neurons_list[1:])[0]
+    means = [layer['neuron_mean'] for layer in profile['layers']]
+    pruned, _ = prune_params(
+        params, means, min_mean=args.min_rate * amp, tol=args.tol)
+
+    # --- compare before and after
+    before = view.compute_static_stats(params, images, labels, neurons_list)
+    after = view.compute_static_stats(pruned, images, labels, neurons_list)
+
+    print("%-16s %20s %20s" % ("", "before", "after"))
+    print("%-16s %20s %20s" % (
+        "sizes", _sizes(params), _sizes(pruned)))
+    print("%-16s %20d %20d" % (
+        "neurons", sum(_sizes(params)[1:-1]), sum(_sizes(pruned)[1:-1])))
+    for [name, _], b, a in zip(neurons_list, before, after):
+        print("%-16s %19.2f%% %19.2f%%" % (
+            "%s error" % name, 100 * b['errors'].mean(),
+            100 * a['errors'].mean()))
+
+    if not args.no_sim:
+        import run
+        t_before = run.time_simulation(params, images, labels)
+        t_after = run.time_simulation(pruned, images, labels)
+        print("%-16s %18.3fms %18.3fms" % (
+            "step time", 1e3 * t_before, 1e3 * t_after))
+
+    if args.savefile is not None:
+        np.savez(args.savefile, **pruned)
+        print("Saved pruned network at '%s'" % args.savefile)
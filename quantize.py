@@ -0,0 +1,246 @@
+"""
+Post-training quantization of trained networks to int8 or int16 weights.
+
+Weights are quantized symmetrically with one scale per layer or one scale
+per (post-synaptic) neuron. Layer inputs are quantized with one scale per
+image, so static inference multiplies integer matrices only, then rescales
+the integer accumulators.
+
+Integer products are accumulated in a floating-point BLAS matrix product,
+which is exact as long as the accumulators stay within the float mantissa
+(see `_accumulator_dtype`); NumPy's own integer matrix product does not use
+BLAS and is much slower.
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+import inference
+
+
+def quantize(x, bits, axis=None):
+    """Symmetric linear quantization, such that `x ~= q * scale`
+
+    With `axis=None` there is one scale for the whole array, otherwise
+    there is one scale for each slice along `axis` (which is reduced).
+    """
+    qmax = 2**(bits - 1) - 1
+    absmax = np.abs(x).max(axis=axis, keepdims=axis is not None)
+    scale = np.maximum(absmax, 1e-12) / qmax
+    q = np.round(x / scale).astype('int%d' % bits)
+    return q, np.asarray(scale, dtype='float32')
+
+
+def _accumulator_dtype(bits, n_inputs):
+    """Smallest float type holding sums of `n_inputs` products exactly"""
+    qmax = 2**(bits - 1) - 1
+    bound = n_inputs * qmax * qmax
+    return 'float32' if bound < 2**24 else 'float64'
+
+
+def quantize_params(params, bits=8, per_neuron=False):
+    """Quantize the weights of a params dictionary
+
+    Biases are kept in floating point, since they are added after the
+    accumulators are rescaled.
+    """
+    axis = 0 if per_neuron else None
+    qparams = dict(bits=bits, per_neuron=per_neuron, neuron=params['neuron'],
+                   biases=[np.asarray(b, dtype='float32')
+                           for b in params['biases']],
+                   bc=np.asarray(params['bc'], dtype='float32'))
+    qparams['qweights'], qparams['wscales'] = zip(*[
+        quantize(np.asarray(w), bits, axis=axis) for w in params['weights']])
+    qparams['qWc'], qparams['cscale'] = quantize(
+        np.asarray(params['Wc']), bits, axis=axis)
+    for k in ['image_mean', 'image_std']:
+        if k in params:
+            qparams[k] = params[k]
+    return qparams
+
+
+def dequantize_params(qparams):
+    """Floating-point params equivalent to quantized params"""
+    params = dict(
+        weights=[q * s for q, s in zip(qparams['qweights'], qparams['wscales'])],
+        biases=list(qparams['biases']),
+        Wc=qparams['qWc'] * qparams['cscale'],
+        bc=qparams['bc'],
+        neuron=qparams['neuron'])
+    for k in ['image_mean', 'image_std']:
+        if k in qparams:
+            params[k] = qparams[k]
+    return params
+
+
+def _object_array(arrays):
+    """1-D object array of per-layer arrays, which may share a shape"""
+    out = np.empty(len(arrays), dtype=object)
+    for i, x in enumerate(arrays):
+        out[i] = x
+    return out
+
+
+def save(filename, qparams):
+    qparams = dict(qparams)
+    for k in ['qweights', 'wscales', 'biases']:
+        qparams[k] = _object_array(qparams[k])
+    np.savez(filename, **qparams)
+
+
+def load(filename):
+    with np.load(filename) as data:
+        qparams = dict((k, data[k]) for k in data.files)
+    qparams['bits'] = int(qparams['bits'])
+    return qparams
+
+
+def test_save_load():
+    """Round-trip quantized params through a file, per layer and per neuron"""
+    import os
+    import shutil
+    import tempfile
+
+    rng = np.random.RandomState(4)
+    sizes = [784, 200, 50, 10]
+    params = dict(
+        weights=[rng.normal(size=s) for s in zip(sizes[:-2], sizes[1:-1])],
+        biases=[rng.normal(size=n) for n in sizes[1:-1]],
+        Wc=rng.normal(size=sizes[-2:]), bc=rng.normal(size=sizes[-1]),
+        neuron=inference.default_neuron)
+    path = tempfile.mkdtemp()
+    try:
+        for per_neuron in [False, True]:
+            qparams = quantize_params(params, per_neuron=per_neuron)
+            filename = os.path.join(path, 'q.npz')
+            save(filename, qparams)
+            expected = dequantize_params(qparams)
+            loaded = inference.load_params(filename)
+            for k in ['weights', 'biases']:
+                assert len(loaded[k]) == len(expected[k])
+                for x, y in zip(loaded[k], expected[k]):
+                    assert np.array_equal(x, y)
+            for k in ['Wc', 'bc']:
+                assert np.array_equal(loaded[k], expected[k])
+    finally:
+        shutil.rmtree(path)
+
+
+def _dot_quantized(x, q, scale, bits):
+    """Integer matrix product of quantized inputs and weights, rescaled"""
+    qx, sx = quantize(x, bits, axis=1)
+    dtype = _accumulator_dtype(bits, q.shape[0])
+    acc = np.dot(qx.astype(dtype), q.astype(dtype))
+    return (acc * sx) * scale
+
+
+def propup_quantized(qparams, images, neuron):
+    """Static forward pass with integer weights and activations"""
+    bits = qparams['bits']
+    neuron_fn = inference.get_numpy_fn(*neuron)
+
+    x = images
+    for q, s, b in zip(qparams['qweights'], qparams['wscales'],
+                       qparams['biases']):
+        x = neuron_fn(_dot_quantized(x, q, s, bits) + b)
+    return _dot_quantized(x, qparams['qWc'], qparams['cscale'], bits) + \
+        qparams['bc']
+
+
+def compute_quantized_error(qparams, images, labels, neuron, chunk_size=1000):
+    classes = np.unique(labels)
+    errors = np.zeros(len(images), dtype=bool)
+    for i in range(0, len(images), chunk_size):
+        yc = propup_quantized(qparams, images[i:i+chunk_size], neuron)
+        errors[i:i+chunk_size] = (
+            labels[i:i+chunk_size] != classes[np.argmax(yc, axis=1)])
+    return errors
+
+
+def weight_bytes(params):
+    """Memory used by the weights, scales and biases of a params dict"""
+    keys = ['weights', 'biases', 'Wc', 'bc',
+            'qweights', 'wscales', 'qWc', 'cscale']
+    arrays = []
+    for k in keys:
+        if k in params:
+            v = params[k]
+            arrays.extend(v if isinstance(v, (list, tuple)) or
+                          getattr(v, 'dtype', None) == object else [v])
+    return sum(np.asarray(a).nbytes for a in arrays)
+
+
+def _throughput(f, images, n_repeats=3):
+    times = []
+    for _ in range(n_repeats):
+        timer = time.time()
+        f(images)
+        times.append(time.time() - timer)
+    return len(images) / min(times)
+
+
+def report(params, qparams, images, labels, neurons_list):
+    """Compare accuracy, memory and throughput of float and quantized nets"""
+    import view
+
+    float32 = dict((k, [np.asarray(w, dtype='float32') for w in params[k]])
+                   for k in ['weights', 'biases'])
+    float32.update((k, np.asarray(params[k], dtype='float32'))
+                   for k in ['Wc', 'bc'])
+
+    stats = view.compute_static_stats(params, images, labels, neurons_list,
+                                      dtype='float32')
+    print("%-8s %12s %12s %12s" % ("neuron", "float", "int%d" % qparams[
+        'bits'], "delta"))
+    for neuron, stat in zip(neurons_list, stats):
+        error = stat['errors'].mean()
+        qerror = compute_quantized_error(qparams, images, labels, neuron).mean()
+        print("%-8s %11.2f%% %11.2f%% %+11.2f%%" % (
+            neuron[0], 100 * error, 100 * qerror, 100 * (qerror - error)))
+
+    nbytes, qbytes = weight_bytes(params), weight_bytes(qparams)
+    print("Weight memory: %0.2f MB -> %0.2f MB (%0.1fx smaller)" % (
+        nbytes / 1e6, qbytes / 1e6, float(nbytes) / qbytes))
+
+    neuron = neurons_list[-1]
+    rate = _throughput(
+        lambda x: inference.propup(float32, x, neuron), images)
+    qrate = _throughput(
+        lambda x: propup_quantized(qparams, x, neuron), images)
+    print("Throughput (%s): float32 %0.0f images/s, int%d %0.0f images/s "
+          "(%0.2fx)" % (neuron[0], rate, qparams['bits'], qrate, qrate / rate))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Quantize the weights of a trained network")
+    parser.add_argument('--bits', type=int, choices=[8, 16], default=8,
+                        help="Bits per weight")
+    parser.add_argument('--per-neuron', action='store_true',
+                        help="Use one scale per neuron instead of per layer")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('loadfile', help="Parameter file to load")
+    parser.add_argument('savefile', nargs='?', default=None,
+                        help="Where to save the quantized network")
+    args = parser.parse_args()
+
+    import mnist
+
+    params = inference.load_params(args.loadfile)
+    qparams = quantize_params(
+        params, bits=args.bits, per_neuron=args.per_neuron)
+
+    _, _, [images, labels] = mnist.load(
+        normalize=True, shuffle=True, spaun=args.spaun,
+        stats=mnist.params_stats(params))
+
+    neurons_list = inference.static_variants(params['neuron'][1])
+    report(params, qparams, images, labels, neurons_list)
+
+    if args.savefile is not None:
+        save(args.savefile, qparams)
+        print("Saved quantized network at '%s'" % args.savefile)
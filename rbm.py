@@ -0,0 +1,327 @@
+"""
+Restricted Boltzmann machines trained with contrastive divergence, in Numpy.
+
+Training works on preallocated float32 buffers. The positive and negative
+phases share one pair of buffers, so each weight update is a single matrix
+product. RBMs can be converted to `Autoencoder`s to pretrain the layers of
+a `DeepAutoencoder`.
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from layers import rms, sparse_mask, FileObject
+
+
+def _sigmoid(x):
+    """Logistic function, in place"""
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    np.reciprocal(x, out=x)
+    return x
+
+
+class RBM(FileObject):
+    """RBM with binary hidden units and binary or Gaussian visible units
+
+    Gaussian visible units have unit variance, and are meant for inputs
+    normalized to zero mean and unit variance.
+    """
+
+    def __init__(self, vis_shape, n_hid, W=None, c=None, b=None, mask=None,
+                 rf_shape=None, gaussian=False, seed=22):
+        dtype = 'float32'
+
+        self.vis_shape = vis_shape if isinstance(vis_shape, tuple) else (vis_shape,)
+        self.n_vis = int(np.prod(vis_shape))
+        self.n_hid = n_hid
+        self.gaussian = gaussian
+        self.seed = seed
+
+        rng = np.random.RandomState(seed=self.seed)
+
+        if W is None:
+            Wmag = 4 * np.sqrt(6. / (self.n_vis + self.n_hid))
+            W = rng.uniform(low=-Wmag, high=Wmag, size=(self.n_vis, self.n_hid))
+
+        if c is None:
+            c = np.zeros(self.n_hid)
+
+        if b is None:
+            b = np.zeros(self.n_vis)
+
+        self.rf_shape = rf_shape
+        self.mask = mask
+        if rf_shape is not None and mask is None:
+            self.mask = sparse_mask(vis_shape, n_hid, rf_shape, rng=rng)
+
+        if self.mask is not None:
+            W = W * self.mask  # make initial W sparse
+
+        self.W = np.array(W, dtype=dtype)
+        self.c = np.array(c, dtype=dtype)
+        self.b = np.array(b, dtype=dtype)
+
+    def __getstate__(self):
+        # buffers and the sampling state are rebuilt when needed
+        return dict((k, v) for k, v in self.__dict__.items()
+                    if not k.startswith('_'))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    @property
+    def filters(self):
+        if self.mask is None:
+            return self.W.T.reshape((self.n_hid,) + self.vis_shape)
+        else:
+            filters = self.W.T[self.mask.T]
+            shape = (self.n_hid,) + self.rf_shape
+            return filters.reshape(shape)
+
+    def propup(self, x):
+        return _sigmoid(np.dot(x, self.W) + self.c)
+
+    def propdown(self, y):
+        a = np.dot(y, self.W.T) + self.b
+        return a if self.gaussian else _sigmoid(a)
+
+    def encode(self, data):
+        return self.propup(np.asarray(data, dtype=self.W.dtype))
+
+    def decode(self, codes):
+        return self.propdown(np.asarray(codes, dtype=self.W.dtype))
+
+    def reconstruct(self, data):
+        return self.decode(self.encode(data))
+
+    def check_params(self):
+        for param in [self.W, self.c, self.b]:
+            assert np.isfinite(param).all()
+
+    def _allocate(self, batch_size):
+        """Buffers for one batch: rows `[:batch_size]` hold the positive
+        phase and rows `[batch_size:]` the negative phase"""
+        dtype = self.W.dtype
+        self._vis = np.zeros((2 * batch_size, self.n_vis), dtype=dtype)
+        self._hid = np.zeros((2 * batch_size, self.n_hid), dtype=dtype)
+        self._samples = np.zeros((batch_size, self.n_hid), dtype=dtype)
+        self._dW = np.zeros_like(self.W)
+        self._Winc = np.zeros_like(self.W)
+        self._cinc = np.zeros_like(self.c)
+        self._binc = np.zeros_like(self.b)
+
+    def _sample(self, prob, out):
+        return np.less(self._rng.random_sample(prob.shape), prob, out=out)
+
+    def _cd_step(self, batch, k, persistent, rate, momentum, weightcost):
+        n = len(batch)
+        vis, hid, samples = self._vis, self._hid, self._samples
+        pos_vis, neg_vis = vis[:n], vis[n:]
+        pos_hid, neg_hid = hid[:n], hid[n:]
+
+        # --- positive phase
+        pos_vis[:] = batch
+        _sigmoid(np.add(np.dot(pos_vis, self.W, out=pos_hid), self.c,
+                        out=pos_hid))
+
+        # --- negative phase: k Gibbs steps from the data or the chains
+        if persistent:
+            samples[:] = self._chains
+        else:
+            self._sample(pos_hid, samples)
+
+        for step in range(k):
+            np.add(np.dot(samples, self.W.T, out=neg_vis), self.b, out=neg_vis)
+            if not self.gaussian:
+                _sigmoid(neg_vis)
+            _sigmoid(np.add(np.dot(neg_vis, self.W, out=neg_hid), self.c,
+                            out=neg_hid))
+            if persistent or step < k - 1:
+                self._sample(neg_hid, samples)
+
+        if persistent:
+            self._chains[:] = samples
+
+        # --- updates: dW = (pos_vis.T pos_hid - neg_vis.T neg_hid) / n
+        dc = pos_hid.mean(axis=0) - neg_hid.mean(axis=0)
+        db = pos_vis.mean(axis=0) - neg_vis.mean(axis=0)
+        np.negative(neg_hid, out=neg_hid)
+        dW = np.dot(vis.T, hid, out=self._dW)
+
+        Winc = self._Winc
+        Winc *= momentum
+        dW *= rate / n
+        Winc += dW
+        Winc -= np.multiply(self.W, rate * weightcost, out=dW)
+        if self.mask is not None:
+            Winc *= self.mask
+
+        self._cinc *= momentum
+        self._cinc += rate * dc
+        self._binc *= momentum
+        self._binc += rate * db
+
+        self.W += Winc
+        self.c += self._cinc
+        self.b += self._binc
+
+    def cd(self, images, test_images=None, batch_size=100, rate=0.1, k=1,
+           persistent=False, momentum=0.5, weightcost=2e-4, n_epochs=10):
+        """Train with CD-k, or persistent CD (PCD-k) if `persistent`
+
+        Reports the reconstruction error on `test_images` (or the first
+        1000 training images) after each epoch.
+        """
+        self._rng = np.random.RandomState(seed=self.seed + 1)
+        self._allocate(batch_size)
+        if persistent:
+            self._chains = np.zeros((batch_size, self.n_hid), dtype=self.W.dtype)
+            self._sample(self.encode(images[:batch_size]), self._chains)
+
+        # slices are views of arrays, and normalized batches of ImageViews
+        n_batches = len(images) // batch_size
+        if isinstance(images, np.ndarray):
+            assert np.isfinite(images).all()
+        check = test_images if test_images is not None else images[:1000]
+
+        for epoch in range(n_epochs):
+            timer = time.time()
+            for i in range(n_batches):
+                batch = images[i * batch_size:(i + 1) * batch_size]
+                self._cd_step(batch, k, persistent, rate, momentum, weightcost)
+            self.check_params()
+
+            error = rms(check - self.reconstruct(check), axis=1).mean()
+            print("Epoch %d: %0.3f (%0.1f s)" % (
+                epoch, error, time.time() - timer))
+
+    def to_autoencoder(self, hid_func=None, vis_func=None, fit=None):
+        """Autoencoder initialized with the weights of this RBM
+
+        With `fit = (a, d)` from `sigmoid_fit(hid_func)`, the weights are
+        rescaled so that the `hid_func` units approximate the RBM's sigmoid
+        probabilities divided by `a`. Gaussian visible units are decoded
+        linearly; binary ones are taken to be the codes of an RBM below
+        converted with the same fit, and are decoded through `vis_func`.
+        """
+        from autoencoder import Autoencoder
+
+        W, c, b = self.W, self.c, self.b
+        if fit is not None:
+            a, d = fit
+            W = a * W if self.gaussian else a * a * W
+            c = a * c + d
+            b = b if self.gaussian else a * b + d
+
+        return Autoencoder(
+            self.vis_shape, self.n_hid, W=W, c=c, b=b,
+            mask=self.mask, rf_shape=self.rf_shape,
+            hid_func=hid_func, vis_func=vis_func, seed=self.seed)
+
+
+def sigmoid_fit(func, u=np.linspace(-6, 6, 121)):
+    """Scale `a` and offset `d` so that `a * func(a*u + d) ~= sigmoid(u)`
+
+    `func` is a Theano unit function (e.g. from `neurons.get_theano_fn`).
+    The fit is weighted towards small `u`, where most inputs to an RBM's
+    hidden units lie.
+    """
+    import theano
+    import theano.tensor as tt
+
+    scales = np.exp(np.linspace(np.log(0.05), np.log(20), 200))
+    offsets = np.linspace(-5, 5, 201)
+    a = scales[:, None, None]
+    x = tt.tensor3('x')
+    y = theano.function([x], func(x))(
+        (a * u + offsets[:, None]).astype(theano.config.floatX))
+
+    weights = np.exp(-u**2 / 8)
+    errors = ((a * y - 1. / (1 + np.exp(-u)))**2 * weights).sum(axis=-1)
+    i, j = np.unravel_index(np.argmin(errors), errors.shape)
+    return scales[i], offsets[j]
+
+
+def pretrain(images, shapes, rf_shapes, hid_func=None, vis_funcs=None,
+             rates=None, **cd_args):
+    """Pretrain the layers of a `DeepAutoencoder` as a stack of RBMs
+
+    The first RBM has Gaussian visible units (for normalized images), and
+    each later RBM is trained on the hidden probabilities of the one below.
+    The RBMs have sigmoid hidden units, so for the resulting autoencoders
+    their weights are rescaled to fit `hid_func` (see `sigmoid_fit`), which
+    should also be the `vis_funcs` of all but the first layer. The fit is
+    only approximate, so the result is an initialization to fine-tune (e.g.
+    with `DeepAutoencoder.auto_sgd`).
+    """
+    from autoencoder import DeepAutoencoder
+
+    n_layers = len(shapes) - 1
+    vis_funcs = vis_funcs if vis_funcs is not None else [None] * n_layers
+    rates = rates if rates is not None else [0.01] + [0.1] * (n_layers - 1)
+    fit = sigmoid_fit(hid_func) if hid_func is not None else None
+
+    deep = DeepAutoencoder()
+    data = images
+    for i in range(n_layers):
+        rbm = RBM(shapes[i], shapes[i+1], rf_shape=rf_shapes[i],
+                  gaussian=(i == 0))
+        rbm.cd(data, rate=rates[i], **cd_args)
+        deep.autos.append(rbm.to_autoencoder(
+            hid_func=hid_func, vis_func=vis_funcs[i], fit=fit))
+        data = rbm.encode(data)
+
+    return deep
+
+
+def test_rbm():
+    import mnist
+
+    [train_images, _], _, [test_images, _] = mnist.load(normalize=True)
+
+    rbm = RBM((28, 28), 500, rf_shape=(9, 9), gaussian=True)
+    rbm.cd(train_images, test_images[:1000], rate=0.01, n_epochs=3)
+    rbm.cd(train_images, test_images[:1000], rate=0.01, persistent=True,
+           n_epochs=2)
+
+    path = tempfile.mkdtemp()
+    try:
+        rbm.to_file(os.path.join(path, 'rbm.npz'))
+        rbm2 = FileObject.from_file(os.path.join(path, 'rbm.npz'))
+    finally:
+        shutil.rmtree(path)
+    assert np.allclose(rbm.reconstruct(test_images[:100]),
+                       rbm2.reconstruct(test_images[:100]))
+
+
+def test_sigmoid_fit():
+    import neurons
+
+    params = dict(sigma=0.01, tau_rc=0.02, tau_ref=0.002, gain=1, bias=1,
+                  amp=1. / 63.04)
+    hid_func = neurons.get_theano_fn('softlif', params)
+    fit = sigmoid_fit(hid_func)
+
+    rng = np.random.RandomState(3)
+    rbm = RBM(50, 20, W=rng.normal(scale=0.3, size=(50, 20)), gaussian=True)
+    rbm2 = RBM(20, 10, W=rng.normal(scale=0.5, size=(20, 10)))
+    x = rng.normal(size=(100, 50)).astype('float32')
+    auto = rbm.to_autoencoder(hid_func=hid_func, fit=fit)
+    auto2 = rbm2.to_autoencoder(hid_func=hid_func, vis_func=hid_func, fit=fit)
+
+    # codes of both layers approximate the RBM probabilities divided by `a`
+    y, y2 = rbm.encode(x), rbm2.encode(rbm.encode(x))
+    assert rms(fit[0] * auto.encode(x) - y) < 0.1
+    assert rms(fit[0] * auto2.encode(auto.encode(x)) - y2) < 0.1
+    assert rms(fit[0] * auto2.decode(y2 / fit[0]) - rbm2.decode(y2)) < 0.1
+
+
+if __name__ == '__main__':
+    test_rbm()
@@ -0,0 +1,157 @@
+"""
+Chunked, lazily loaded records of spiking runs.
+
+A record is a directory holding a small `index.npz` (time base, per
+presentation labels and dataset indices, other metadata) plus one file per
+signal, so that a viewer can load only the signals and time window it needs:
+
+    <signal>.npy          uncompressed signal, memory-mapped on load
+    <signal>/<k>.npz      compressed signal, in chunks of `chunk_len` steps
+    spikes<i>_*.npy       spike events of layer `i` (see `spikes.py`)
+
+Images are not stored; `image_index` refers to rows of the test set as
+returned by `mnist.load(shuffle=True, spaun=spaun)`.
+"""
+import os
+
+import numpy as np
+
+import profiling
+import spikes
+
+
+def save(path, t, signals, compress=(), chunk_len=1000, layers=(), **meta):
+    """Write a record directory
+
+    Parameters
+    ----------
+    t : array (n_steps,)
+        Simulation times (evenly spaced).
+    signals : dict
+        Arrays with `n_steps` rows, by name.
+    compress : iterable
+        Names of signals to store compressed in chunks of `chunk_len` steps.
+    layers : list of `spikes.SpikeEvents`
+        Spike events of each layer.
+    **meta
+        Other (small) arrays to store in the index.
+
+    An existing record at `path` is overwritten: its index is removed first
+    (so that a partly written record is not read) and so are its chunk
+    files, which a longer run may have left beyond the new ones.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if is_record(path):
+        os.remove(os.path.join(path, 'index.npz'))
+
+    n_steps = len(t)
+    dt = float(t[1] - t[0])
+    compress = [name for name in signals if name in compress]
+    for name, x in signals.items():
+        assert len(x) == n_steps
+        if name in compress:
+            chunk_dir = os.path.join(path, name)
+            if not os.path.isdir(chunk_dir):
+                os.mkdir(chunk_dir)
+            for f in os.listdir(chunk_dir):
+                if f.endswith('.npz'):
+                    os.remove(os.path.join(chunk_dir, f))
+            for k, i in enumerate(range(0, n_steps, chunk_len)):
+                np.savez_compressed(_chunk_file(path, name, k),
+                                    x=x[i:i+chunk_len])
+        else:
+            np.save(os.path.join(path, name + '.npy'), x)
+
+    for name, x in spikes.to_dict(layers).items():
+        np.save(os.path.join(path, name + '.npy'), x)
+
+    np.savez(os.path.join(path, 'index.npz'),
+             t0=float(t[0]), dt=dt, n_steps=n_steps, chunk_len=chunk_len,
+             signals=sorted(signals), compressed=compress,
+             n_layers=len(layers), **meta)
+
+
+def is_record(path):
+    return os.path.isfile(os.path.join(path, 'index.npz'))
+
+
+def _chunk_file(path, name, k):
+    return os.path.join(path, name, '%06d.npz' % k)
+
+
+class Record(object):
+    """Read access to a record directory written by `save`"""
+
+    def __init__(self, path):
+        self.path = path
+        index = np.load(os.path.join(path, 'index.npz'))
+        self.index = dict((k, index[k]) for k in index.files)
+        self.t0 = float(self.index['t0'])
+        self.dt = float(self.index['dt'])
+        self.n_steps = int(self.index['n_steps'])
+        self.chunk_len = int(self.index['chunk_len'])
+        self.signals = list(self.index['signals'])
+        self.compressed = list(self.index['compressed'])
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.index[key]
+
+    def steps(self, tstart=None, tstop=None):
+        """Step range [start, stop) covering times in (tstart, tstop]"""
+        start = (0 if tstart is None else
+                 int(np.floor((tstart - self.t0) / self.dt + 1e-6)) + 1)
+        stop = (self.n_steps if tstop is None else
+                int(np.floor((tstop - self.t0) / self.dt + 1e-6)) + 1)
+        return max(start, 0), min(stop, self.n_steps)
+
+    def t(self, tstart=None, tstop=None):
+        start, stop = self.steps(tstart, tstop)
+        return self.t0 + self.dt * np.arange(start, stop)
+
+    @profiling.timed('data.load_record')
+    def load(self, name, tstart=None, tstop=None):
+        """Load a signal, reading only the chunks that cover the window"""
+        start, stop = self.steps(tstart, tstop)
+        if name not in self.compressed:
+            x = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+            return np.array(x[start:stop])
+
+        n = self.chunk_len
+        chunks = []
+        for k in range(start // n, (stop - 1) // n + 1 if stop > start else 0):
+            x = np.load(_chunk_file(self.path, name, k))['x']
+            chunks.append(x[max(start - k*n, 0):stop - k*n])
+        return np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0)
+
+    @profiling.timed('data.load_record')
+    def load_spikes(self, tstart=None, tstop=None):
+        """Load the spike events of all layers within the window"""
+        start, stop = self.steps(tstart, tstop)
+        files = dict((name, np.load(os.path.join(self.path, name + '.npy'),
+                                    mmap_mode='r'))
+                     for i in range(int(self.index['n_layers']))
+                     for name in ['spikes%d_%s' % (i, s)
+                                  for s in ['steps', 'neurons', 'shape']])
+        return [layer.window(start, stop) for layer in spikes.from_dict(files)]
+
+
+def test_overwrite():
+    """Save a shorter record over a longer one"""
+    import shutil
+    import tempfile
+
+    path = tempfile.mkdtemp()
+    try:
+        for n_steps in [25, 12]:
+            t = 0.001 * np.arange(1, n_steps + 1)
+            save(path, t, dict(x=np.arange(n_steps)), compress=['x'],
+                 chunk_len=10)
+        assert sorted(os.listdir(os.path.join(path, 'x'))) == [
+            '000000.npz', '000001.npz']
+        assert np.array_equal(Record(path).load('x'), np.arange(12))
+    finally:
+        shutil.rmtree(path)
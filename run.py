@@ -1,169 +1,355 @@
 from __future__ import print_function
 
 import argparse
+import contextlib
 import os
 import sys
-import urllib
+import time
 
 import nengo
 import numpy as np
 
 import mnist
+import profiling
+import record
+import spikes
+from inference import urls, default_neuron, load_params  # re-exported
 
-urls = {
-    'lif-111-error.npz': 'http://files.figshare.com/2106879/lif_111_error.npz',
-    'lif-126-error.npz': 'http://files.figshare.com/2106875/lif_126_error.npz',
-}
-
-# --- arguments
-parser = argparse.ArgumentParser(description="Run network in spiking neurons")
-parser.add_argument('--gui', action='store_true', help="Run in the GUI")
-parser.add_argument('--spaun', action='store_true',
-                    help="Test with augmented dataset for Spaun")
-parser.add_argument('--sizes', action='store_true',
-                    help="Compute network sizes")
-parser.add_argument('--presentations', type=float, default=20,
-                    help="Number of digits to present to the model")
-parser.add_argument('loadfile', help="Parameter file to load")
-parser.add_argument('savefile', nargs='?', default=None, help="Where to save output")
-args = parser.parse_args()
-
-# --- parameters
-n_pres = args.presentations if not args.gui else 10000
-pres_time = 0.1
-neurons_per_class = 10  # neurons per class in classifier
-synapse = 0.005
-# synapse = nengo.synapses.Alpha(0.005)
-
-# --- functions
-def get_index(t):
-    return int(t / pres_time) % len(images)
-
-def get_image(t):
-    return images[get_index(t)]
-
-def test_classifier(t, dots):
-    return labels[get_index(t)] == classes[np.argmax(dots)]
-
-# --- load the RBM data
-if not os.path.exists(args.loadfile) and args.loadfile in urls:
-    urllib.urlretrieve(urls[args.loadfile], args.loadfile)
-    print("Fetched '%s' to '%s'" % (urls[args.loadfile], args.loadfile))
-
-if os.path.exists(args.loadfile):
-    data = np.load(args.loadfile)
-    weights = data['weights']
-    biases = data['biases']
-    Wc = data['Wc']
-    bc = data['bc']
-    if 'neuron' in data:
-        neuron = data['neuron']
-    else:
-        neuron = ('softlif', dict(sigma=0.01, tau_rc=0.02, tau_ref=0.002,
-                                  gain=1, bias=1, amp=1. / 63.04))
+
+def cast_params(params, dtype):
+    """Copy of `params` with the weights and biases in `dtype`"""
+    cast = dict(params)
+    for k in ['weights', 'biases']:
+        cast[k] = [np.asarray(w, dtype=dtype) for w in params[k]]
+    for k in ['Wc', 'bc']:
+        cast[k] = np.asarray(params[k], dtype=dtype)
+    return cast
+
+
+@contextlib.contextmanager
+def precision(dtype):
+    """Build nengo signals in `dtype` (nengo >= 3.0 only)"""
+    bits = str(8 * np.dtype(dtype).itemsize)
+    old = nengo.rc.get('precision', 'bits')
+    nengo.rc.set('precision', 'bits', bits)
+    try:
+        yield
+    finally:
+        nengo.rc.set('precision', 'bits', old)
+
+
+def cast_signals(built, dtype):
+    """Cast the float signals of a built model to `dtype` in place
+
+    Nengo < 3.0 always builds its signals in float64, so they are cast
+    after the build, before the simulator copies them.
+    """
+    dtype = np.dtype(dtype)
+    for op in built.operators:
+        for sig in op.all_signals:
+            base = sig.base
+            if base._value.dtype.kind == 'f' and base._value.dtype != dtype:
+                base._value = base._value.astype(dtype)
+
+
+def make_simulator(model, dt=0.001, dtype='float64'):
+    if nengo.rc.has_section('precision'):
+        with precision(dtype):
+            return nengo.Simulator(model, dt=dt)
+
+    built = nengo.builder.Model(
+        dt=float(dt), label="%s, dt=%f" % (model, dt),
+        decoder_cache=nengo.cache.get_default_decoder_cache())
+    built.build(model)
+    cast_signals(built, dtype)
+    return nengo.Simulator(None, dt=dt, model=built)
+
+
+def signal_bytes(sim):
+    """Memory used by the simulator signals (not counting views)"""
+    return sum(x.nbytes for sig, x in sim.signals.items()
+               if getattr(sig, 'base', sig) is sig)
+
+
+def build_model(params, images, labels, pres_time=0.1, synapse=0.005,
+                neurons_per_class=10, seed=97):
+    """Build the spiking network, presenting each image for `pres_time`
+
+    Returns the model and a dictionary of the objects in it that are of
+    interest for probing.
+    """
+    weights, biases = params['weights'], params['biases']
+    Wc, bc = params['Wc'], params['bc']
     n_classifier = bc.size
-    sizes = [weights[0].shape[0]] + [len(b) for b in biases] + [len(bc)]
-    print("Loaded %s %s network" % (sizes, neuron[0]))
-else:
-    raise ValueError("Cannot find or download '%s'" % args.loadfile)
 
-# --- load the testing data
-_, _, [images, labels] = mnist.load(
-    normalize=True, shuffle=True, spaun=args.spaun)
+    classes = np.unique(labels)
+    assert classes.size == n_classifier
 
-classes = np.unique(labels)
-assert classes.size == n_classifier
+    # --- functions
+    def get_index(t):
+        return int(t / pres_time) % len(images)
 
-# --- create the model
-neuron_name, neuron_params = neuron
-if neuron_name in ['softlif', 'lif']:
-    if neuron_name == 'softlif':
-        print("Running 'softlif' as 'lif'")
-    tau_rc, tau_ref, gain, bias, amp = [
-        neuron_params[k] for k in ['tau_rc', 'tau_ref', 'gain', 'bias', 'amp']]
-    neuron_type = nengo.LIF(tau_rc=tau_rc, tau_ref=tau_ref)
-else:
-    raise ValueError("Unrecognized neuron '%s'" % neuron_name)
-
-model = nengo.Network(seed=97)
-with model:
-    input_images = nengo.Node(output=get_image, label='images')
-
-    # --- make nonlinear layers
-    layers = []
-    for i, [W, b] in enumerate(zip(weights, biases)):
-        layer = nengo.Ensemble(b.size, 1, label='layer %d' % i)
-        layer.neuron_type = neuron_type
-        layer.gain = nengo.dists.Choice([gain])
-        layer.bias = nengo.dists.Choice([bias])
-
-        layer_bias = nengo.Node(output=b, label='bias %d' % i)
-        nengo.Connection(layer_bias, layer.neurons, synapse=None)
-
-        if i == 0:
-            nengo.Connection(input_images, layer.neurons,
-                             transform=W.T, synapse=synapse)
-        else:
-            nengo.Connection(layers[-1].neurons, layer.neurons,
-                             transform=W.T * amp, synapse=synapse)
-
-        layers.append(layer)
-
-    # --- make classifier
-    class_layer = nengo.networks.EnsembleArray(
-        neurons_per_class, n_classifier, label='class', radius=5)
-    class_bias = nengo.Node(output=bc)
-    nengo.Connection(class_bias, class_layer.input, synapse=None)
-    nengo.Connection(layers[-1].neurons, class_layer.input,
-                     transform=Wc.T * amp, synapse=synapse)
-
-    test = nengo.Node(output=test_classifier, size_in=n_classifier)
-    nengo.Connection(class_layer.output, test)
-
-# --- stats
-if args.sizes:
-    print("%10s:%10s%10s%10s" % ("", "neurons", "synapses", "full"))
-    for i, [W, b] in enumerate(zip(weights, biases)):
-        print("%10s:%10d%10d%10d" % (
-            "Layer %d" % (i+1), b.size, (W != 0).sum(), W.size))
-
-# --- simulation
-if args.gui:
-    import nengo_gui
-    nengo_gui.Viz(__file__).start()
-    sys.exit(0)
-
-with model:
-    # --- make probes
-    if n_pres <= 100:
-        probe_layers = [nengo.Probe(layer.neurons) for layer in layers]
+    def get_image(t):
+        return images[get_index(t)]
+
+    def test_classifier(t, dots):
+        return labels[get_index(t)] == classes[np.argmax(dots)]
+
+    # --- create the model
+    neuron_name, neuron_params = params['neuron']
+    if neuron_name in ['softlif', 'lif']:
+        tau_rc, tau_ref, gain, bias, amp = [neuron_params[k] for k in [
+            'tau_rc', 'tau_ref', 'gain', 'bias', 'amp']]
+        neuron_type = nengo.LIF(tau_rc=tau_rc, tau_ref=tau_ref)
     else:
-        probe_layers = []
-    probe_class = nengo.Probe(class_layer.output, synapse=0.03)
-    probe_test = nengo.Probe(test, synapse=0.01)
+        raise ValueError("Unrecognized neuron '%s'" % neuron_name)
+
+    model = nengo.Network(seed=seed)
+    with model:
+        input_images = nengo.Node(output=get_image, label='images')
+
+        # --- make nonlinear layers
+        layers = []
+        for i, [W, b] in enumerate(zip(weights, biases)):
+            layer = nengo.Ensemble(b.size, 1, label='layer %d' % i)
+            layer.neuron_type = neuron_type
+            layer.gain = nengo.dists.Choice([gain])
+            layer.bias = nengo.dists.Choice([bias])
+
+            layer_bias = nengo.Node(output=b, label='bias %d' % i)
+            nengo.Connection(layer_bias, layer.neurons, synapse=None)
+
+            if i == 0:
+                nengo.Connection(input_images, layer.neurons,
+                                 transform=W.T, synapse=synapse)
+            else:
+                nengo.Connection(layers[-1].neurons, layer.neurons,
+                                 transform=W.T * amp, synapse=synapse)
+
+            layers.append(layer)
+
+        # --- make classifier
+        class_layer = nengo.networks.EnsembleArray(
+            neurons_per_class, n_classifier, label='class', radius=5)
+        class_bias = nengo.Node(output=bc)
+        nengo.Connection(class_bias, class_layer.input, synapse=None)
+        nengo.Connection(layers[-1].neurons, class_layer.input,
+                         transform=Wc.T * amp, synapse=synapse)
+
+        test = nengo.Node(output=test_classifier, size_in=n_classifier)
+        nengo.Connection(class_layer.output, test)
+
+    return model, dict(layers=layers, class_layer=class_layer, test=test)
+
+
+def run_spiking(params, images, labels, n_pres, pres_time=0.1, dt=0.001,
+                record_spikes=False, dtype='float64', **model_args):
+    """Simulate the spiking network for `n_pres` presentations
+
+    Returns the simulation times, the filtered classifier output and
+    correctness, and the spike events of each layer (if `record_spikes`).
+    """
+    timer = time.time()
+    model, objs = build_model(
+        cast_params(params, dtype), images.astype(dtype, copy=False), labels,
+        pres_time=pres_time, **model_args)
+
+    with model:
+        # --- make probes (spikes are recorded as events, not dense arrays)
+        recorders = []
+        if record_spikes:
+            for i, layer in enumerate(objs['layers']):
+                recorder = spikes.SpikeRecorder(layer.n_neurons, dt)
+                node = nengo.Node(recorder, size_in=layer.n_neurons,
+                                  size_out=0, label='spikes %d' % i)
+                nengo.Connection(layer.neurons, node, synapse=None)
+                recorders.append(recorder)
+        probe_class = nengo.Probe(objs['class_layer'].output, synapse=0.03)
+        probe_test = nengo.Probe(objs['test'], synapse=0.01)
+
+    sim = make_simulator(model, dt=dt, dtype=dtype)
+    profiling.add_time('run.build', time.time() - timer)
+
+    with profiling.timer('run.simulate'):
+        sim.run(pres_time * n_pres)
+    profiling.count('run.steps', sim.n_steps)
+
+    t = sim.trange()
+    layers = tuple(recorder.events for recorder in recorders)
+    return t, sim.data[probe_class], sim.data[probe_test], layers
+
+
+def _time_steps(sim, n_steps):
+    sim.step()  # warm up
+
+    timer = time.time()
+    for _ in range(n_steps):
+        sim.step()
+    return (time.time() - timer) / n_steps
+
+
+def time_simulation(params, images, labels, n_steps=500, dt=0.001,
+                    dtype='float64', **model_args):
+    """Mean wall time per simulation step (excluding the build)"""
+    model, _ = build_model(cast_params(params, dtype),
+                           images.astype(dtype, copy=False), labels,
+                           **model_args)
+    return _time_steps(make_simulator(model, dt=dt, dtype=dtype), n_steps)
+
+
+def compare_precision(params, images, labels, n_pres,
+                      dtypes=('float64', 'float32'), pres_time=0.1, dt=0.001,
+                      n_steps=500, **model_args):
+    """Step time, signal memory and error of the network in each dtype"""
+    from view import compute_spiking_error
+
+    rows = []
+    for dtype in dtypes:
+        model, _ = build_model(cast_params(params, dtype),
+                               images.astype(dtype, copy=False), labels,
+                               pres_time=pres_time, **model_args)
+        sim = make_simulator(model, dt=dt, dtype=dtype)
+        nbytes = signal_bytes(sim)
+        step_time = _time_steps(sim, n_steps)
+        del sim
+
+        t, _, test, _ = run_spiking(
+            params, images, labels, n_pres, pres_time=pres_time, dt=dt,
+            dtype=dtype, **model_args)
+        errors = compute_spiking_error(t, test, pres_time)
+        rows.append(dict(dtype=dtype, step_time=step_time,
+                         signal_bytes=nbytes, error=errors.mean()))
+    return rows
+
+
+def print_precision(rows):
+    print("%-8s %12s %12s %10s" % ("dtype", "step time", "signals", "error"))
+    for row in rows:
+        print("%-8s %10.3fms %10.2fMB %9.2f%%" % (
+            row['dtype'], 1e3 * row['step_time'], row['signal_bytes'] / 1e6,
+            100 * row['error']))
+
+
+if __name__ == '__main__':
+    # --- arguments
+    parser = argparse.ArgumentParser(
+        description="Run network in spiking neurons")
+    parser.add_argument('--gui', action='store_true', help="Run in the GUI")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('--sizes', action='store_true',
+                        help="Compute network sizes")
+    parser.add_argument('--spikes', action='store_true',
+                        help="Record layer spikes "
+                        "(default for <= 100 presentations)")
+    parser.add_argument('--cost', action='store_true',
+                        help="Count spikes and synaptic operations per digit "
+                        "(records layer spikes)")
+    parser.add_argument('--latency', action='store_true',
+                        help="Show error over time since onset and decision "
+                        "latencies")
+    parser.add_argument('--compress', action='store_true',
+                        help="Compress smooth traces in the saved record")
+    parser.add_argument('--dtype', choices=['float64', 'float32'],
+                        default='float64',
+                        help="Precision of the weights and simulator signals")
+    parser.add_argument('--compare-dtypes', action='store_true',
+                        help="Compare step time, memory and error in float64 "
+                        "and float32, then exit")
+    parser.add_argument('--presentations', type=float, default=20,
+                        help="Number of digits to present to the model")
+    parser.add_argument('--profile', action='store_true',
+                        help="Time the build, simulation and analysis, and "
+                        "save a profile")
+    parser.add_argument('loadfile', help="Parameter file to load")
+    parser.add_argument('savefile', nargs='?', default=None,
+                        help="Where to save output (a record directory, "
+                        "or a single file if ending in '.npz')")
+    args = parser.parse_args()
+    profiling.enable(args.profile)
+
+    # --- parameters
+    n_pres = args.presentations if not args.gui else 10000
+    pres_time = 0.1
+    neurons_per_class = 10  # neurons per class in classifier
+    synapse = 0.005
+    # synapse = nengo.synapses.Alpha(0.005)
+
+    # --- load the RBM data
+    params = load_params(args.loadfile)
+    weights, biases, bc = params['weights'], params['biases'], params['bc']
+    sizes = [weights[0].shape[0]] + [len(b) for b in biases] + [len(bc)]
+    print("Loaded %s %s network" % (sizes, params['neuron'][0]))
+    if params['neuron'][0] == 'softlif':
+        print("Running 'softlif' as 'lif'")
+
+    # --- load the testing data
+    _, _, [images, labels] = mnist.load(
+        normalize=True, shuffle=True, spaun=args.spaun,
+        stats=mnist.params_stats(params))
+    classes = np.unique(labels)
+
+    # --- stats
+    if args.sizes:
+        print("%10s:%10s%10s%10s" % ("", "neurons", "synapses", "full"))
+        for i, [W, b] in enumerate(zip(weights, biases)):
+            print("%10s:%10d%10d%10d" % (
+                "Layer %d" % (i+1), b.size, (W != 0).sum(), W.size))
+
+    # --- simulation
+    if args.compare_dtypes:
+        print_precision(compare_precision(
+            params, images, labels, n_pres, pres_time=pres_time,
+            synapse=synapse, neurons_per_class=neurons_per_class))
+        sys.exit(0)
+
+    if args.gui:
+        import nengo_gui
+        model, _ = build_model(
+            params, images, labels, pres_time=pres_time, synapse=synapse,
+            neurons_per_class=neurons_per_class)
+        nengo_gui.Viz(__file__).start()
+        sys.exit(0)
 
-sim = nengo.Simulator(model)
-sim.run(pres_time * n_pres)
+    t, classifier, test, layers = run_spiking(
+        params, images, labels, n_pres, pres_time=pres_time, synapse=synapse,
+        neurons_per_class=neurons_per_class, dtype=args.dtype,
+        record_spikes=args.spikes or args.cost or n_pres <= 100)
 
-t = sim.trange()
+    with profiling.timer('run.save'):
+        if args.savefile is not None and args.savefile.endswith('.npz'):
+            np.savez(args.savefile,
+                     t=t, classes=classes, images=images, labels=labels,
+                     classifier=classifier, test=test, pres_time=pres_time,
+                     **spikes.to_dict(layers))
+            print("Saved data at '%s'" % args.savefile)
+        elif args.savefile is not None:
+            image_index = np.arange(int(np.ceil(n_pres))) % len(images)
+            record.save(
+                args.savefile, t, dict(classifier=classifier, test=test),
+                compress=['classifier', 'test'] if args.compress else [],
+                layers=layers, pres_time=pres_time, classes=classes,
+                image_index=image_index, labels=labels[image_index],
+                spaun=args.spaun)
+            print("Saved record at '%s'" % args.savefile)
 
-layers = tuple(sim.data[p] for p in probe_layers)
-classifier = sim.data[probe_class]
-test = sim.data[probe_test]
+    # --- view results (see also view.py)
+    from view import (compute_spiking_error, compute_spiking_cost,
+                      compute_spiking_latency, print_spiking_cost,
+                      view_spiking, view_spiking_latency)
 
-if args.savefile is not None:
-    np.savez(args.savefile,
-             t=t, classes=classes, images=images, labels=labels,
-             classifier=classifier, test=test, pres_time=pres_time)
-    print("Saved data at '%s'" % args.savefile)
+    errors = compute_spiking_error(t, test, pres_time)
+    print("Spiking network error: %0.2f%%" % (100 * errors.mean()))
 
-# --- view results (see also view.py)
-from view import compute_spiking_error, view_spiking
+    if args.latency:
+        view_spiking_latency(*compute_spiking_latency(
+            t, classifier, labels, pres_time, classes=classes))
 
-errors = compute_spiking_error(t, test, pres_time)
-print("Spiking network error: %0.2f%%" % (100 * errors.mean()))
+    if args.cost:
+        print_spiking_cost(compute_spiking_cost(
+            params, layers, pres_time, float(t[1] - t[0])))
 
-imgfile = (os.path.splitext(args.savefile)[0] + '.png'
-           if args.savefile is not None else None)
-view_spiking(t, images, labels, classifier, test, pres_time,
-             layers=layers, savefile=imgfile)
+    imgfile = (os.path.splitext(args.savefile.rstrip(os.sep))[0] + '.png'
+               if args.savefile is not None else None)
+    view_spiking(t, images, labels, classifier, test, pres_time,
+                 layers=layers, savefile=imgfile)
@@ -0,0 +1,362 @@
+"""
+Local inference server for trained networks.
+
+Loads a params file once, and classifies images sent over HTTP with the
+static (rate) network of `inference.py`. Concurrent requests are collected
+into micro-batches, so that the matrix products run on many images at once:
+a batch is run when it has `--max-batch` images, or when its first request
+has waited `--max-latency` seconds.
+
+    POST /classify     images as JSON (`{"images": [[...], ...]}`, pixels in
+                       [0, 1]) or raw uint8 pixels (`application/octet-stream`);
+                       returns `{"labels": [...]}`
+    GET /stats         request latency percentiles, throughput and batch sizes
+    POST /stats/reset  restart the counters
+    GET /health
+"""
+from __future__ import print_function
+
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import Queue
+import SocketServer
+import threading
+import time
+import urllib2
+
+import numpy as np
+
+import inference
+import mnist
+
+
+class MicroBatcher(object):
+    """Collect concurrent requests into batches for `predict`
+
+    A batch is run when it has `max_batch` images, or when its first
+    request has waited `max_latency` seconds. The latencies and batch
+    sizes of the last `window` requests are kept for `stats`.
+    """
+
+    def __init__(self, predict, max_batch=256, max_latency=0.005,
+                 window=10000):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.window = window
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.reset()
+
+        self.thread = threading.Thread(target=self._run, name='batcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.counts = dict(requests=0, images=0, batches=0, errors=0)
+            self.latencies = collections.deque(maxlen=self.window)
+            self.batch_sizes = collections.deque(maxlen=self.window)
+
+    def submit(self, images):
+        """Classify `images`, waiting for the batch; returns the labels"""
+        request = dict(images=images, time=time.time(),
+                       done=threading.Event(), labels=None, error=None)
+        self.queue.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['labels']
+
+    def _run(self):
+        while True:
+            requests = [self.queue.get()]
+            n = len(requests[0]['images'])
+            deadline = requests[0]['time'] + self.max_latency
+            while n < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(self.queue.get(timeout=timeout))
+                except Queue.Empty:
+                    break
+                n += len(requests[-1]['images'])
+            self._process(requests)
+
+    def _process(self, requests):
+        images = np.vstack([r['images'] for r in requests])
+        try:
+            labels, _ = self.predict(images)
+        except Exception as e:
+            for r in requests:
+                r['error'] = e
+                r['done'].set()
+            with self.lock:
+                self.counts['errors'] += len(requests)
+            return
+
+        done = time.time()
+        with self.lock:
+            self.counts['requests'] += len(requests)
+            self.counts['images'] += len(images)
+            self.counts['batches'] += 1
+            self.batch_sizes.append(len(images))
+            self.latencies.extend(done - r['time'] for r in requests)
+
+        i = 0
+        for r in requests:
+            n = len(r['images'])
+            r['labels'] = labels[i:i + n]
+            r['done'].set()
+            i += n
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            latencies = np.array(self.latencies)
+            sizes = np.array(self.batch_sizes)
+            elapsed = time.time() - self.start_time
+
+        stats = dict(counts, uptime=elapsed,
+                     requests_per_s=counts['requests'] / elapsed,
+                     images_per_s=counts['images'] / elapsed)
+        if len(latencies) > 0:
+            stats.update(
+                latency_p50_ms=1e3 * np.percentile(latencies, 50),
+                latency_p99_ms=1e3 * np.percentile(latencies, 99),
+                latency_max_ms=1e3 * latencies.max(),
+                mean_batch=sizes.mean())
+        return stats
+
+
+def decode_images(body, content_type, n_pixels):
+    """Images in [0, 1] from a JSON or raw uint8 request body"""
+    if content_type.startswith('application/octet-stream'):
+        pixels = np.frombuffer(body, dtype='uint8')
+        if pixels.size == 0 or pixels.size % n_pixels != 0:
+            raise ValueError("Expected a multiple of %d pixels" % n_pixels)
+        return pixels.reshape(-1, n_pixels) * np.float32(1. / 255)
+
+    images = np.asarray(json.loads(body)['images'], dtype='float32')
+    images = images.reshape(1, -1) if images.ndim == 1 else images
+    if images.ndim != 2 or images.shape[1] != n_pixels or len(images) == 0:
+        raise ValueError("Expected images of %d pixels" % n_pixels)
+    return images
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive between requests
+
+    def _send(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.batcher.stats())
+        elif self.path == '/health':
+            self._send(200, dict(status='ok'))
+        else:
+            self._send(404, dict(error="Unknown path '%s'" % self.path))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/stats/reset':
+            self.server.batcher.reset()
+            self._send(200, dict(status='ok'))
+            return
+        elif self.path != '/classify':
+            self._send(404, dict(error="Unknown path '%s'" % self.path))
+            return
+
+        try:
+            images = decode_images(body, self.headers.get('Content-Type', ''),
+                                   self.server.n_pixels)
+        except (ValueError, KeyError) as e:
+            self._send(400, dict(error=str(e)))
+            return
+
+        try:
+            labels = self.server.batcher.submit(images)
+        except Exception as e:
+            self._send(500, dict(error=str(e)))
+            return
+        self._send(200, dict(labels=labels.tolist()))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 drops bursts
+
+    def __init__(self, address, model, verbose=False, **batch_args):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.batcher = MicroBatcher(model.predict, **batch_args)
+        self.n_pixels = model.n_pixels
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+
+def classify(url, images):
+    """Labels of images in [0, 1] from a running server"""
+    pixels = np.round(np.clip(images, 0, 1) * 255).astype('uint8')
+    request = urllib2.Request(url + '/classify', pixels.tobytes(),
+                              {'Content-Type': 'application/octet-stream'})
+    return np.array(json.loads(urllib2.urlopen(request).read())['labels'])
+
+
+def get_stats(url):
+    return json.loads(urllib2.urlopen(url + '/stats').read())
+
+
+def load_test(url, images, n_clients=16, n_requests=2000, batch_size=1):
+    """Classify images from `n_clients` concurrent clients
+
+    Returns the labels and the client-side latency and throughput.
+    """
+    labels = np.zeros(n_requests * batch_size, dtype=int)
+    latencies = np.zeros(n_requests)
+    counter = iter(range(n_requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            j = np.arange(i * batch_size, (i + 1) * batch_size) % len(images)
+            timer = time.time()
+            labels[i * batch_size:(i + 1) * batch_size] = classify(
+                url, images[j])
+            latencies[i] = time.time() - timer
+
+    timer = time.time()
+    threads = [threading.Thread(target=client) for _ in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - timer
+
+    return labels, dict(
+        requests_per_s=n_requests / elapsed,
+        images_per_s=n_requests * batch_size / elapsed,
+        latency_p50_ms=1e3 * np.percentile(latencies, 50),
+        latency_p99_ms=1e3 * np.percentile(latencies, 99))
+
+
+def print_stats(stats):
+    for k in sorted(stats):
+        print("%-20s %12.3f" % (k, stats[k]))
+
+
+def test_serve():
+    """Serve a random network on localhost, and check it against `predict`"""
+    rng = np.random.RandomState(9)
+    sizes = [784, 300, 10]
+    params = dict(
+        weights=[rng.normal(scale=0.1, size=s)
+                 for s in zip(sizes[:-2], sizes[1:-1])],
+        biases=[np.zeros(sizes[1])],
+        Wc=rng.normal(scale=0.1, size=sizes[-2:]), bc=np.zeros(sizes[-1]))
+    neuron = inference.static_variants(dict(
+        tau_rc=0.02, tau_ref=0.002, gain=1, bias=1, amp=1. / 63.04))[1]
+    model = inference.StaticModel(params, neuron)
+
+    pixels = rng.randint(256, size=(500, 784)).astype('uint8')
+    images = pixels / 255.
+    server = Server(('127.0.0.1', 0), model, max_latency=0.002)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        labels, client_stats = load_test(
+            server.url, images, n_clients=8, n_requests=len(images))
+        expected, _ = model.predict(pixels * np.float32(1. / 255))
+        assert np.array_equal(labels, expected)
+        print_stats(client_stats)
+        print_stats(get_stats(server.url))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve a trained network for classifying images")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="Port to listen on")
+    parser.add_argument('--neuron', choices=['lif', 'softlif'], default='lif',
+                        help="Neuron model of the static network")
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        default='float32', help="Precision of the network")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Network trained with augmented dataset for "
+                        "Spaun (normalizes params files without stored "
+                        "statistics, and tests with --load-test)")
+    parser.add_argument('--max-batch', type=int, default=256,
+                        help="Images per batch at most")
+    parser.add_argument('--max-latency', type=float, default=0.005,
+                        help="Longest time [s] a request waits for its batch "
+                        "to fill")
+    parser.add_argument('--load-test', action='store_true',
+                        help="Classify test images from concurrent local "
+                        "clients, print the statistics and exit")
+    parser.add_argument('--clients', type=int, default=16,
+                        help="Number of concurrent clients for --load-test")
+    parser.add_argument('--requests', type=int, default=2000,
+                        help="Number of requests for --load-test")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Log every request")
+    parser.add_argument('loadfile', help="Parameter file to serve")
+    args = parser.parse_args()
+
+    model = inference.load_model(args.loadfile, neuron=args.neuron,
+                                 dtype=args.dtype, spaun=args.spaun)
+    address = (args.host, 0 if args.load_test else args.port)
+    server = Server(address, model, verbose=args.verbose,
+                    max_batch=args.max_batch, max_latency=args.max_latency)
+
+    if not args.load_test:
+        print("Serving '%s' at %s" % (args.loadfile, server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+    else:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        _, _, [images, labels] = mnist.load(shuffle=True, spaun=args.spaun)
+        server.batcher.reset()
+        predicted, client_stats = load_test(
+            server.url, images, n_clients=args.clients,
+            n_requests=args.requests)
+        n = len(predicted)
+        print("Error: %0.2f%%" % (
+            100 * np.mean(predicted != labels[np.arange(n) % len(labels)])))
+        print("----- Clients -----")
+        print_stats(client_stats)
+        print("----- Server -----")
+        print_stats(get_stats(server.url))
+        server.shutdown()
@@ -0,0 +1,143 @@
+"""
+Compact event-based storage of spike trains.
+
+Spikes are stored as lists of (timestep index, neuron index) events rather
+than as dense (n_steps, n_neurons) arrays, which are almost entirely zeros.
+"""
+import numpy as np
+
+index_dtype = 'int32'
+
+
+class SpikeEvents(object):
+    """Spike trains of a population, stored as sorted event lists
+
+    `steps[k]` and `neurons[k]` give the timestep index and neuron index of
+    the k-th spike. Events are sorted by timestep. A neuron spiking more than
+    once in a timestep appears once per spike.
+    """
+
+    def __init__(self, steps, neurons, n_steps, n_neurons):
+        self.steps = np.asarray(steps, dtype=index_dtype)
+        self.neurons = np.asarray(neurons, dtype=index_dtype)
+        assert self.steps.shape == self.neurons.shape
+        self.n_steps = int(n_steps)
+        self.n_neurons = int(n_neurons)
+
+    @classmethod
+    def from_dense(cls, spikes, dt):
+        """Create from a dense array of spikes with height `1 / dt`"""
+        spikes = np.asarray(spikes)
+        steps, neurons = np.nonzero(spikes)
+        counts = np.round(spikes[steps, neurons] * dt).astype(index_dtype)
+        return cls(np.repeat(steps, counts), np.repeat(neurons, counts),
+                   *spikes.shape)
+
+    @property
+    def shape(self):
+        return (self.n_steps, self.n_neurons)
+
+    @property
+    def n_spikes(self):
+        return self.steps.size
+
+    @property
+    def nbytes(self):
+        return self.steps.nbytes + self.neurons.nbytes
+
+    def rate(self, dt):
+        """Mean spikes per neuron per second"""
+        return self.n_spikes / float(self.n_steps * self.n_neurons * dt)
+
+    def window(self, start, stop):
+        """Events in the timestep range [start, stop), rebased to `start`"""
+        start = max(int(start), 0)
+        stop = min(int(stop), self.n_steps)
+        i, j = np.searchsorted(self.steps, [start, stop])
+        return SpikeEvents(self.steps[i:j] - start, self.neurons[i:j],
+                           stop - start, self.n_neurons)
+
+    def select(self, n_neurons):
+        """Events of the first `n_neurons` neurons only"""
+        keep = self.neurons < n_neurons
+        return SpikeEvents(self.steps[keep], self.neurons[keep],
+                           self.n_steps, min(n_neurons, self.n_neurons))
+
+    def counts(self, block_len):
+        """Spike counts of each neuron in consecutive blocks of timesteps
+
+        Returns an array (n_blocks, n_neurons); with `block_len` the length
+        of a presentation, this gives the spikes of each neuron per digit.
+        """
+        n_blocks = -(-self.n_steps // block_len)
+        i = self.steps.astype('int64') // block_len
+        counts = np.bincount(i * self.n_neurons + self.neurons,
+                             minlength=n_blocks * self.n_neurons)
+        return counts.reshape(n_blocks, self.n_neurons)
+
+    def density(self, n_tbins, n_nbins):
+        """Spike counts binned into `n_tbins` time by `n_nbins` neuron bins"""
+        n_tbins = min(n_tbins, self.n_steps)
+        n_nbins = min(n_nbins, self.n_neurons)
+        i = (self.steps.astype('int64') * n_tbins) // self.n_steps
+        j = (self.neurons.astype('int64') * n_nbins) // self.n_neurons
+        counts = np.bincount(i * n_nbins + j, minlength=n_tbins * n_nbins)
+        return counts.reshape(n_tbins, n_nbins)
+
+
+class SpikeRecorder(object):
+    """Node output function recording incoming spikes as events
+
+    Connect a population's neurons to a `nengo.Node(recorder, size_in=n)`
+    with `synapse=None`; this avoids the dense arrays kept by `nengo.Probe`.
+    """
+
+    def __init__(self, n_neurons, dt):
+        self.n_neurons = n_neurons
+        self.dt = dt
+        self.reset()
+
+    def reset(self):
+        self._steps = []
+        self._neurons = []
+        self.n_steps = 0
+
+    def __call__(self, t, x):
+        if t <= 0:
+            return  # called by the builder to check the output size
+
+        step = int(round(t / self.dt)) - 1
+        neurons = np.flatnonzero(x)
+        if neurons.size > 0:
+            counts = np.round(x[neurons] * self.dt).astype(index_dtype)
+            self._steps.append(np.repeat(step, counts.sum()))
+            self._neurons.append(np.repeat(neurons, counts))
+        self.n_steps = step + 1
+
+    @property
+    def events(self):
+        empty = [np.zeros(0, dtype=index_dtype)]
+        return SpikeEvents(np.concatenate(self._steps + empty),
+                           np.concatenate(self._neurons + empty),
+                           self.n_steps, self.n_neurons)
+
+
+def to_dict(layers, prefix='spikes'):
+    """Flatten a list of `SpikeEvents` into arrays for `np.savez`"""
+    d = {}
+    for i, layer in enumerate(layers):
+        d['%s%d_steps' % (prefix, i)] = layer.steps
+        d['%s%d_neurons' % (prefix, i)] = layer.neurons
+        d['%s%d_shape' % (prefix, i)] = np.array(layer.shape)
+    return d
+
+
+def from_dict(data, prefix='spikes'):
+    """Read a list of `SpikeEvents` written by `to_dict`"""
+    layers = []
+    while '%s%d_shape' % (prefix, len(layers)) in data:
+        i = len(layers)
+        layers.append(SpikeEvents(data['%s%d_steps' % (prefix, i)],
+                                  data['%s%d_neurons' % (prefix, i)],
+                                  *data['%s%d_shape' % (prefix, i)]))
+    return layers
@@ -0,0 +1,172 @@
+"""
+Sweep spiking-network parameters for accuracy/latency trade-offs.
+
+Each combination of synapse time constant, timestep, presentation time and
+classifier size is simulated on the same subset of test digits in a pool of
+worker processes. The results table gives accuracy against simulated time
+per digit and wall time per digit, and marks the Pareto-optimal settings.
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import multiprocessing
+import time
+
+import numpy as np
+
+columns = ['synapse', 'dt', 'pres_time', 'neurons_per_class',
+           'error', 'sim_time', 'wall_time', 'pareto']
+
+_shared = {}
+
+
+def _check_time(pres_time):
+    return min(0.05, 0.5 * pres_time)
+
+
+def _divides(dt, x):
+    n = x / dt
+    return round(n) >= 1 and abs(n - round(n)) < 1e-6
+
+
+def check_grid(grid):
+    """Raise ValueError for timesteps that do not divide the presentation
+
+    The spiking error is scored on whole timesteps of each presentation and
+    of its final `check_time`, so `dt` must divide both evenly.
+    """
+    bad = ['dt=%g, pres_time=%g' % (dt, pres_time)
+           for dt in grid['dt'] for pres_time in grid['pres_time']
+           if not (_divides(dt, pres_time) and
+                   _divides(dt, _check_time(pres_time)))]
+    if len(bad) > 0:
+        raise ValueError("Timesteps must divide the presentation time and "
+                         "check time evenly; got %s" % '; '.join(bad))
+
+
+def _init_worker(params, images, labels):
+    _shared.update(params=params, images=images, labels=labels)
+
+
+def _simulate(config):
+    import run
+    import view
+
+    params, images, labels = (
+        _shared['params'], _shared['images'], _shared['labels'])
+    n_pres = len(images)
+    pres_time = config['pres_time']
+
+    timer = time.time()
+    t, _, test, _ = run.run_spiking(
+        params, images, labels, n_pres, pres_time=pres_time, dt=config['dt'],
+        synapse=config['synapse'],
+        neurons_per_class=config['neurons_per_class'])
+    wall_time = time.time() - timer
+
+    errors = view.compute_spiking_error(
+        t, test, pres_time, check_time=_check_time(pres_time))
+    return dict(config, error=errors.mean(), sim_time=pres_time,
+                wall_time=wall_time / n_pres)
+
+
+def pareto_front(costs):
+    """Mask of rows of `costs` (n, k) not dominated by any other row
+
+    All costs are minimized; a row is dominated if another row is no worse
+    in every cost and better in at least one.
+    """
+    costs = np.asarray(costs)
+    no_worse = (costs[:, None, :] <= costs[None, :, :]).all(axis=2)
+    better = (costs[:, None, :] < costs[None, :, :]).any(axis=2)
+    dominates = no_worse & better  # [i, j]: row i dominates row j
+    return ~dominates.any(axis=0)
+
+
+def sweep(params, images, labels, grid, n_workers=None):
+    """Simulate every combination in `grid` (a dict of lists of values)"""
+    check_grid(grid)
+    keys = sorted(grid)
+    configs = [dict(zip(keys, values))
+               for values in itertools.product(*[grid[k] for k in keys])]
+
+    pool = multiprocessing.Pool(n_workers, initializer=_init_worker,
+                                initargs=(params, images, labels))
+    try:
+        rows = []
+        for row in pool.imap_unordered(_simulate, configs):
+            rows.append(row)
+            print("synapse=%g, dt=%g, pres_time=%g, npc=%d: %0.2f%% error, "
+                  "%0.3f s wall / digit" % (
+                      row['synapse'], row['dt'], row['pres_time'],
+                      row['neurons_per_class'], 100 * row['error'],
+                      row['wall_time']))
+    finally:
+        pool.close()
+        pool.join()
+
+    costs = [(row['error'], row['sim_time'], row['wall_time']) for row in rows]
+    for row, pareto in zip(rows, pareto_front(costs)):
+        row['pareto'] = pareto
+    rows.sort(key=lambda row: (row['sim_time'], row['error']))
+    return rows
+
+
+def write_table(rows, filename):
+    with open(filename, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for row in rows:
+            f.write(','.join(str(row[c]) for c in columns) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Sweep spiking parameters for accuracy and speed")
+    parser.add_argument('--synapse', type=float, nargs='+', default=[0.005],
+                        help="Synapse time constants [s]")
+    parser.add_argument('--dt', type=float, nargs='+', default=[0.001],
+                        help="Simulation timesteps [s]")
+    parser.add_argument('--pres-time', type=float, nargs='+', default=[0.1],
+                        help="Presentation times per digit [s]")
+    parser.add_argument('--neurons-per-class', type=int, nargs='+',
+                        default=[10], help="Classifier neurons per class")
+    parser.add_argument('--presentations', type=int, default=100,
+                        help="Number of test digits to present")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of worker processes (default: #CPUs)")
+    parser.add_argument('--spaun', action='store_true',
+                        help="Test with augmented dataset for Spaun")
+    parser.add_argument('--output', default='sweep.csv',
+                        help="Where to write the results table")
+    parser.add_argument('loadfile', help="Parameter file to load")
+    args = parser.parse_args()
+
+    import mnist
+    import run
+
+    grid = dict(synapse=args.synapse, dt=args.dt, pres_time=args.pres_time,
+                neurons_per_class=args.neurons_per_class)
+    try:
+        check_grid(grid)
+    except ValueError as e:
+        parser.error(str(e))
+
+    params = run.load_params(args.loadfile)
+    _, _, [images, labels] = mnist.load(
+        normalize=True, shuffle=True, spaun=args.spaun,
+        stats=mnist.params_stats(params))
+    images = images[:args.presentations]  # all labels, to find the classes
+
+    rows = sweep(params, images, labels, grid, n_workers=args.workers)
+    write_table(rows, args.output)
+
+    print("%8s %8s %10s %5s %8s %14s" % (
+        "synapse", "dt", "pres_time", "npc", "error", "wall / digit"))
+    for row in rows:
+        print("%8g %8g %10g %5d %7.2f%% %13.3fs %s" % (
+            row['synapse'], row['dt'], row['pres_time'],
+            row['neurons_per_class'], 100 * row['error'], row['wall_time'],
+            '*' if row['pareto'] else ''))
+    print("* Pareto-optimal in error, simulated time and wall time")
+    print("Wrote %d results to '%s'" % (len(rows), args.output))
@@ -9,6 +9,16 @@ parser = argparse.ArgumentParser(description="Train a deep network on MNIST")
 parser.add_argument('--gpu', action='store_true', help="Train on the GPU")
 parser.add_argument('--spaun', action='store_true',
                     help="Train with augmented dataset for Spaun")
+parser.add_argument('--rbm', action='store_true',
+                    help="Pretrain layers as RBMs instead of autoencoders")
+parser.add_argument('--compact', action='store_true',
+                    help="Keep the training images as uint8, normalizing "
+                    "each batch")
+parser.add_argument('--no-cache', action='store_true',
+                    help="Compile training functions without the cache")
+parser.add_argument('--profile', action='store_true',
+                    help="Time loading, compiling, training steps, evaluation "
+                    "and plotting, and save a profile")
 parser.add_argument('savefile', nargs='?', default=None, help="Where to save output")
 args = parser.parse_args()
 
@@ -20,14 +30,20 @@ if args.gpu:
 import theano
 import theano.tensor as tt
 
+import function_cache
 import mnist
 import neurons
 import plotting
+import profiling
 from autoencoder import (
     rms, show_recons, FileObject, Autoencoder, DeepAutoencoder)
 
 plt.ion()
 
+if args.no_cache:
+    function_cache.enabled = False
+profiling.enable(args.profile)
+
 # --- define the network architecture
 if 1:
     # architecture one
@@ -51,29 +67,38 @@ neuron_fn = neurons.get_theano_fn(*neuron)
 
 # --- load the data
 train, valid, test = mnist.load(
-    normalize=True, shuffle=True, spaun=args.spaun)
+    normalize=True, shuffle=True, spaun=args.spaun, compact=args.compact)
+if args.compact:
+    test = (test[0][:], test[1])  # small, and plotted as float images
 train_images, test_images = train[0], test[0]
 
 # --- pretrain with SGD backprop
 n_epochs = 15
 batch_size = 100
 
-deep = DeepAutoencoder()
-data = train_images
-for i in range(n_layers):
-    vis_func = None if i == 0 else neuron_fn
+if args.rbm:
+    import rbm
+    vis_funcs = [None] + [neuron_fn] * (n_layers - 1)
+    deep = rbm.pretrain(train_images, shapes, rf_shapes, hid_func=neuron_fn,
+                        vis_funcs=vis_funcs, n_epochs=n_epochs)
+else:
+    deep = DeepAutoencoder()
+    data = train_images
+    for i in range(n_layers):
+        vis_func = None if i == 0 else neuron_fn
 
-    # create autoencoder for the next layer
-    auto = Autoencoder(
-        shapes[i], shapes[i+1], rf_shape=rf_shapes[i],
-        vis_func=vis_func, hid_func=neuron_fn)
-    deep.autos.append(auto)
+        # create autoencoder for the next layer
+        auto = Autoencoder(
+            shapes[i], shapes[i+1], rf_shape=rf_shapes[i],
+            vis_func=vis_func, hid_func=neuron_fn)
+        deep.autos.append(auto)
 
-    # train the autoencoder using SGD
-    auto.auto_sgd(data, deep, test_images, n_epochs=n_epochs, rate=rates[i])
+        # train the autoencoder using SGD
+        auto.auto_sgd(data, deep, test_images, n_epochs=n_epochs,
+                      rate=rates[i])
 
-    # hidden layer activations become training data for next layer
-    data = auto.encode(data)
+        # hidden layer activations become training data for next layer
+        data = auto.encode(data)
 
 plt.figure(99)
 plt.clf()
@@ -94,6 +119,8 @@ deep.sgd(train, test, n_epochs=150, tradeoff=1, noise=0.3, shift=True, rate=0.1)
 # deep.sgd(train, test, n_epochs=150, tradeoff=1, noise=0.3, shift=True, rate=0.01)
 print "mean error", deep.test(test).mean()
 
+function_cache.report()
+
 # --- save parameters
 savefile = args.savefile
 if savefile is None:
@@ -109,5 +136,6 @@ if all(hasattr(auto, 'V') for auto in deep.autos):
 d['Wc'] = deep.W
 d['bc'] = deep.b
 d['neuron'] = neuron
+d['image_mean'], d['image_std'] = mnist.normalization(spaun=args.spaun)
 
 np.savez(savefile, **d)
@@ -2,64 +2,144 @@ from __future__ import print_function
 
 import argparse
 import os
+import sys
+import time
 
-import nengo
 import numpy as np
-import matplotlib.pyplot as plt
 
+import inference
 import mnist
-import neurons
-
-
-def _propup_static(params, images, neuron):
-    weights = params['weights']
-    biases = params['biases']
-    Wc = params['Wc']
-    bc = params['bc']
-    n_classifier = bc.size
-
-    neuron_name, neuron_params = neuron
-    neuron_fn = neurons.get_numpy_fn(neuron_name, neuron_params)
-
-    def forward(x, weights, biases):
-        layers = []
-        for w, b in zip(weights, biases):
-            x = neuron_fn(np.dot(x, w) + b)
-            layers.append(x)
-        return x, layers
-
-    codes, layers = forward(images, weights, biases)
-    yc = np.dot(codes, Wc) + bc
-    return layers, codes, yc
-
-
-def compute_static_error(params, images, labels, neuron):
-    layers, codes, yc = _propup_static(params, images, neuron)
-    inds = np.argmax(yc, axis=1)
+import profiling
+import record
+import spikes
+
+
+@profiling.timed('analysis.static_stats')
+def compute_static_stats(params, images, labels, neurons_list,
+                         chunk_size=1000, n_threads=1, dtype='float64',
+                         n_bins=15):
+    """Evaluate several neuron variants of a static network in one pass
+
+    The images are processed in chunks of `chunk_size`, on a pool of
+    `n_threads` threads if more than one (NumPy releases the GIL in the
+    matrix products, but a multithreaded BLAS already uses all cores).
+    Use `dtype='float32'` for speed, at a small change in the errors.
+    First-layer pre-activations are shared between the neuron variants, and
+    only summary statistics are kept, never full activation matrices.
+
+    Returns a list with one dictionary of statistics per neuron variant.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    weights = [np.asarray(w, dtype=dtype) for w in params['weights']]
+    biases = [np.asarray(b, dtype=dtype) for b in params['biases']]
+    Wc = np.asarray(params['Wc'], dtype=dtype)
+    bc = np.asarray(params['bc'], dtype=dtype)
     classes = np.unique(labels)
-    errors = (labels != classes[inds])
-    return errors
-
-
-def view_static(params, images, labels, neuron):
-    layers, codes, yc = _propup_static(params, images, neuron)
 
+    neuron_fns = [inference.get_numpy_fn(*neuron) for neuron in neurons_list]
+    bin_edges = [np.linspace(0, p['amp'] / p['tau_ref'], n_bins + 1)
+                 for _, p in neurons_list]
+
+    def evaluate(start):
+        x = np.asarray(images[start:start + chunk_size], dtype=dtype)
+        y = labels[start:start + chunk_size]
+        a0 = np.dot(x, weights[0]) + biases[0]
+
+        results = []
+        for neuron_fn, edges in zip(neuron_fns, bin_edges):
+            layers = []
+            h = neuron_fn(a0)
+            for i in range(len(weights)):
+                if i > 0:
+                    h = neuron_fn(np.dot(h, weights[i]) + biases[i])
+                layers.append(dict(
+                    sum=h.sum(dtype='float64'),
+                    neuron_sum=h.sum(axis=0, dtype='float64'),
+                    n_pos=np.count_nonzero(h > 0),
+                    n_gt1=np.count_nonzero(h > 1),
+                    hist=np.histogram(h, bins=edges)[0]))
+
+            yc = np.dot(h, Wc) + bc
+            results.append(dict(
+                layers=layers,
+                errors=(y != classes[np.argmax(yc, axis=1)]),
+                yc_sum=yc.sum(axis=0, dtype='float64'),
+                yc_sum2=(yc.astype('float64')**2).sum(axis=0),
+                yc_min=yc.min(), yc_max=yc.max()))
+        return start, results
+
+    n = len(images)
+    stats = [dict(errors=np.zeros(n, dtype=bool), layers=[dict(
+        sum=0., neuron_sum=0., n_pos=0, n_gt1=0, hist=0,
+        bin_edges=edges, size=n * w.shape[1]) for w in weights],
+        yc_sum=0., yc_sum2=0., yc_min=np.inf, yc_max=-np.inf)
+        for edges in bin_edges]
+
+    starts = range(0, n, chunk_size)
+    pool = ThreadPool(n_threads) if n_threads != 1 else None
+    try:
+        for start, results in (pool.imap_unordered(evaluate, starts)
+                               if pool is not None else
+                               (evaluate(s) for s in starts)):
+            for stat, result in zip(stats, results):
+                stat['errors'][start:start + chunk_size] = result['errors']
+                stat['yc_min'] = min(stat['yc_min'], result['yc_min'])
+                stat['yc_max'] = max(stat['yc_max'], result['yc_max'])
+                for k in ['yc_sum', 'yc_sum2']:
+                    stat[k] = stat[k] + result[k]
+                for layer, rlayer in zip(stat['layers'], result['layers']):
+                    for k in ['sum', 'neuron_sum', 'n_pos', 'n_gt1', 'hist']:
+                        layer[k] = layer[k] + rlayer[k]
+    finally:
+        if pool is not None:
+            pool.close()
+
+    for stat in stats:
+        for layer in stat['layers']:
+            layer['mean'] = layer['sum'] / layer['size']
+            layer['neuron_mean'] = layer['neuron_sum'] / n
+            layer['sparsity'] = float(layer['n_pos']) / layer['size']
+            layer['sparsity1'] = float(layer['n_gt1']) / layer['size']
+
+        yc_mean = stat['yc_sum'] / n
+        stat['yc_mean'] = yc_mean.mean()
+        stat['yc_std'] = np.sqrt(np.maximum(
+            stat['yc_sum2'] / n - yc_mean**2, 0)).mean()
+
+    return stats
+
+
+def compute_static_error(params, images, labels, neuron, **kwargs):
+    return compute_static_stats(
+        params, images, labels, [neuron], **kwargs)[0]['errors']
+
+
+def view_static(stats):
+    """Show statistics computed by `compute_static_stats` for one neuron"""
+    import matplotlib.pyplot as plt
+
+    timer = time.time()
+    layers = stats['layers']
     for i, layer in enumerate(layers):
         print("Layer %d: mean=%0.3f; sparsity=%0.3f (>0), %0.3f (>1)" % (
-            i, layer.mean(), (layer > 0).mean(), (layer > 1).mean()))
+            i, layer['mean'], layer['sparsity'], layer['sparsity1']))
 
     print("Classifier: mean=%0.3f, std=%0.3f, min=%0.3f, max=%0.3f" % (
-        yc.mean(), yc.std(0).mean(), yc.min(), yc.max()))
+        stats['yc_mean'], stats['yc_std'], stats['yc_min'], stats['yc_max']))
 
     plt.figure()
     r = len(layers)
     for i, layer in enumerate(layers):
         plt.subplot(r, 1, i+1)
-        plt.hist(layer.flatten(), bins=15)
+        edges = layer['bin_edges']
+        plt.bar(edges[:-1], layer['hist'], width=np.diff(edges), align='edge')
 
+    profiling.add_time('plot.static', time.time() - timer)
     plt.show()
 
 
+@profiling.timed('analysis.spiking_error')
 def compute_spiking_error(t, test, pres_time, check_time=0.05, cutoff=0.5):
     assert test.ndim == 1 or test.ndim == 2 and test.shape[1] == 1
     dt = float(t[1] - t[0])
@@ -73,47 +153,237 @@ def compute_spiking_error(t, test, pres_time, check_time=0.05, cutoff=0.5):
         test = test_pad
 
     # take blocks at the end of each presentation
-    blocks = test.reshape(-1, pres_len)[:, -check_time:]
+    blocks = test.reshape(-1, pres_len)[:, -check_len:]
     errors = np.mean(blocks, axis=1) < cutoff
     return errors
 
 
+def presentation_window(tstart, tstop, pres_time):
+    """Window `(tstart, tstop]` rounded in to whole presentations
+
+    `tstop` may be None, for the end of the run.
+    """
+    tstart = pres_time * np.floor(tstart / pres_time + 1e-6)
+    if tstop is not None:
+        tstop = pres_time * np.floor(tstop / pres_time + 1e-6)
+        if tstop <= tstart:
+            raise ValueError("Window is shorter than one presentation "
+                             "(%g s)" % pres_time)
+    return tstart, tstop
+
+
+@profiling.timed('analysis.spiking_latency')
+def compute_spiking_latency(t, classifier, labels, pres_time, classes=None):
+    """Error rate over time since stimulus onset, and decision latencies
+
+    A presentation's decision latency is the first time after onset from
+    which the argmax of the classifier output stays correct until the end of
+    the presentation (`inf` if it is wrong at the end).
+
+    Returns the times since onset (pres_len,), the error rate at each of
+    these times over all presentations, and the latency of each
+    presentation (n_pres,). Only presentations with a label are scored.
+    """
+    dt = float(t[1] - t[0])
+    pres_len = int(round(pres_time / dt))
+    n_pres = min(len(classifier) // pres_len, len(labels))
+    classes = np.unique(labels) if classes is None else classes
+
+    blocks = classifier[:n_pres * pres_len].reshape(n_pres, pres_len, -1)
+    wrong = classes[np.argmax(blocks, axis=2)] != labels[:n_pres, None]
+    onset_t = dt * np.arange(1, pres_len + 1)
+    error = wrong.mean(axis=0)
+
+    # first step after the last wrong step
+    last_wrong = pres_len - 1 - np.argmax(wrong[:, ::-1], axis=1)
+    settle = np.where(wrong.any(axis=1), last_wrong + 1, 0)
+    latency = np.where(
+        settle < pres_len, onset_t[np.minimum(settle, pres_len - 1)], np.inf)
+    return onset_t, error, latency
+
+
+@profiling.timed('plot.spiking_latency')
+def view_spiking_latency(onset_t, error, latency, savefile=None):
+    import matplotlib.pyplot as plt
+
+    settled = np.isfinite(latency)
+    print("Final error: %0.2f%%; never settled: %0.2f%%" % (
+        100 * error[-1], 100 * (~settled).mean()))
+    if settled.any():
+        p50, p90, p99 = np.percentile(latency[settled], [50, 90, 99])
+        print("Decision latency: p50=%0.1f ms, p90=%0.1f ms, p99=%0.1f ms" % (
+            1e3 * p50, 1e3 * p90, 1e3 * p99))
+
+    plt.figure()
+    plt.subplot(211)
+    plt.plot(1e3 * onset_t, 100 * error)
+    plt.xlabel('time since onset [ms]')
+    plt.ylabel('error [%]')
+
+    plt.subplot(212)
+    if settled.any():
+        plt.hist(1e3 * latency[settled], bins=min(onset_t.size, 50),
+                 range=(0, 1e3 * onset_t[-1]))
+    plt.xlabel('decision latency [ms]')
+    plt.ylabel('presentations')
+    plt.tight_layout()
+
+    if savefile is not None:
+        plt.savefig(savefile)
+        print("Saved image at '%s'" % savefile)
+
+
+@profiling.timed('analysis.spiking_cost')
+def compute_spiking_cost(params, layers, pres_time, dt):
+    """Synaptic operations per presentation, by layer
+
+    Each spike costs one synaptic operation per nonzero outgoing weight of
+    its neuron. The input layer is driven by the (analog) image every
+    timestep, so costs one operation per nonzero weight per timestep. This is
+    compared with the multiply-accumulates of an equivalent dense rate
+    network, which computes each weight matrix once per image.
+
+    `layers` are the spikes of the hidden layers, as `spikes.SpikeEvents`
+    or dense arrays; a partial presentation at the end is not counted.
+    Returns a list of dictionaries, one per layer.
+    """
+    pres_len = int(round(pres_time / dt))
+    weights = list(params['weights']) + [params['Wc']]
+
+    W = weights[0]
+    rows = [dict(name='input', neurons=W.shape[0], spikes=np.nan,
+                 fan_out=(W != 0).sum(axis=1).mean(),
+                 synops=float((W != 0).sum() * pres_len), dense=W.size)]
+    for i, [layer, W] in enumerate(zip(layers, weights[1:])):
+        if not isinstance(layer, spikes.SpikeEvents):
+            layer = spikes.SpikeEvents.from_dense(layer, dt)
+        counts = layer.counts(pres_len)[:layer.n_steps // pres_len]
+        fan_out = (W != 0).sum(axis=1)
+        rows.append(dict(
+            name='layer %d' % (i+1), neurons=layer.n_neurons,
+            spikes=counts.sum(axis=1).mean(), fan_out=fan_out.mean(),
+            synops=np.dot(counts, fan_out).mean(), dense=W.size))
+
+    for row in rows:
+        row['relative'] = row['synops'] / float(row['dense'])
+    return rows
+
+
+def print_spiking_cost(rows):
+    print("%10s:%10s%12s%10s%14s%14s%10s" % (
+        "", "neurons", "spikes/pres", "fan-out", "synops/pres", "dense MACs",
+        "relative"))
+    for row in rows:
+        print("%10s:%10d%12.1f%10.1f%14.0f%14d%10.3f" % (
+            row['name'], row['neurons'], row['spikes'], row['fan_out'],
+            row['synops'], row['dense'], row['relative']))
+
+    synops = sum(row['synops'] for row in rows)
+    hidden = sum(row['synops'] for row in rows[1:])
+    dense = sum(row['dense'] for row in rows)
+    print("Total: %0.0f synops / digit (%0.0f from spikes), %d dense MACs "
+          "(%0.3f relative)" % (synops, hidden, dense, synops / float(dense)))
+
+
+def _envelope(t, x, n_bins):
+    """Decimate `x` to the min/max envelope of `n_bins` time bins
+
+    Plotting the result as a line draws the full vertical extent of the
+    signal in each bin, so nothing visible is lost at that resolution.
+    """
+    n = len(t) // n_bins
+    if n < 2:
+        return t, x
+
+    m = n * n_bins
+    xb = x[:m].reshape((n_bins, n) + x.shape[1:])
+    tb = t[:m].reshape(n_bins, n)
+    t_env = np.repeat(tb.mean(axis=1), 2)
+    x_env = np.empty((2 * n_bins,) + x.shape[1:], dtype=x.dtype)
+    x_env[0::2] = xb.min(axis=1)
+    x_env[1::2] = xb.max(axis=1)
+    if m < len(t):  # keep the tail
+        t_env = np.hstack([t_env, t[m:]])
+        x_env = np.concatenate([x_env, x[m:]])
+    return t_env, x_env
+
+
+def _rasterplot(t, events, ax=None):
+    """Raster plot of `SpikeEvents` without densifying them"""
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    ax.plot(t[events.steps], events.neurons + 1, '|', color='k',
+            markersize=max(1, 200. / max(events.n_neurons, 1)))
+    ax.set_xlim([t[0], t[-1]])
+    ax.set_ylim([events.n_neurons + 0.5, 0.5])
+    return ax
+
+
+def _densityplot(t, events, n_tbins, n_nbins, ax=None):
+    """Binned spike-density image of `SpikeEvents`"""
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    dt = float(t[1] - t[0])
+    counts = events.density(n_tbins, n_nbins)
+    ax.imshow(counts.T, aspect='auto', interpolation='nearest',
+              cmap='gist_yarg', origin='upper',
+              extent=[t[0] - dt, t[-1], events.n_neurons + 0.5, 0.5])
+    return ax
+
+
 def view_spiking(t, images, labels, classifier, test, pres_time, max_pres=20,
-                 layers=[], savefile=None):
-    from nengo.utils.matplotlib import rasterplot
+                 layers=[], savefile=None, max_points=None):
+    """Plot a spiking run
+
+    Traces are decimated to at most `max_points` min/max pairs (by default,
+    the figure width in pixels), and layers with many neurons or spikes are
+    drawn as binned spike densities rather than rasters.
+    """
+    import matplotlib.pyplot as plt
+
+    timer = time.time()
     dt = float(t[1] - t[0])
+    layers = [layer if isinstance(layer, spikes.SpikeEvents)
+              else spikes.SpikeEvents.from_dense(layer, dt)
+              for layer in layers]
 
     # --- compute statistics on whole data
     for i, layer in enumerate(layers):
-        rate = (layer > 0).mean() / dt
-        print("Layer %d: %0.3f spikes / neuron / s" % (i+1, rate))
+        print("Layer %d: %0.3f spikes / neuron / s" % (i+1, layer.rate(dt)))
 
-    # --- plots for partial data
+    # --- plots for partial data (`t` may start part way through a run)
+    t_start = t[0] - dt
     def plot_bars():
+        bars = np.arange(t_start, t[-1], pres_time)
+        if len(bars) > max_points / 4:
+            return  # too dense to be useful
         ylim = plt.ylim()
-        for x in np.arange(0, t[-1], pres_time):
-            plt.plot([x, x], ylim, 'k--')
+        plt.vlines(bars, *ylim, colors='k', linestyles='dashed')
+        plt.ylim(ylim)
 
-    n_pres = min(int(t[-1] / pres_time), max_pres)
+    n_pres = min(int(round((t[-1] - t_start) / pres_time)), max_pres)
     images = images[:n_pres]
     labels = labels[:n_pres]
 
-    max_t = n_pres * pres_time
-    tmask = t <= max_t
+    max_t = t_start + n_pres * pres_time
+    tmask = t <= max_t + 0.5 * dt
     t = t[tmask]
     classifier = classifier[tmask]
     test = test[tmask]
-    layers = [layer[tmask] for layer in layers]
+    layers = [layer.window(0, tmask.sum()) for layer in layers]
 
-    allimage = np.zeros((28, 28 * len(images)), dtype=images.dtype)
-    for i, image in enumerate(images):
-        allimage[:, i * 28:(i + 1) * 28] = image.reshape(28, 28)
+    allimage = images.reshape(-1, 28, 28).transpose(1, 0, 2).reshape(28, -1)
+
+    fig = plt.figure()
+    if max_points is None:
+        max_points = int(fig.get_size_inches()[0] * fig.dpi)
 
-    plt.figure()
     r, c = 3 + len(layers), 1
     def next_subplot(i=np.array([0])):
         i[:] += 1
-        return plt.subplot(r, c, i)
+        return plt.subplot(r, c, i[0])
 
     next_subplot()
     plt.imshow(allimage, aspect='auto', interpolation='none', cmap='gray')
@@ -121,24 +391,24 @@ def view_spiking(t, images, labels, classifier, test, pres_time, max_pres=20,
     plt.yticks([])
 
     max_neurons = 200
+    max_spikes = 50000
     for i, layer in enumerate(layers):
-        n_neurons = layer.shape[1]
         next_subplot()
-        if n_neurons > max_neurons:
-            layer = layer[:, :max_neurons]
-        rasterplot(t, layer)
+        if layer.n_neurons > max_neurons or layer.n_spikes > max_spikes:
+            _densityplot(t, layer, max_points, max_neurons)
+        else:
+            _rasterplot(t, layer)
         plot_bars()
         plt.xticks([])
-        plt.ylabel('layer %d (%d)' % (i+1, n_neurons))
-
+        plt.ylabel('layer %d (%d)' % (i+1, layer.n_neurons))
 
     next_subplot()
-    plt.plot(t, classifier)
+    plt.plot(*_envelope(t, classifier, max_points))
     plot_bars()
     plt.ylabel('class')
 
     next_subplot()
-    plt.plot(t, test)
+    plt.plot(*_envelope(t, test, max_points))
     plt.ylim([-0.1, 1.1])
     plot_bars()
     plt.ylabel('correct')
@@ -149,58 +419,201 @@ def view_spiking(t, images, labels, classifier, test, pres_time, max_pres=20,
         plt.savefig(savefile)
         print("Saved image at '%s'" % savefile)
 
+    profiling.add_time('plot.spiking', time.time() - timer)
     plt.show()
 
 
+def view_record(rec, window=None, images=None, max_pres=20,
+                show_spikes=True, latency=False, params=None):
+    """Score and plot a window of a spiking `record.Record`
+
+    The window `(tstart, tstop]` is rounded in to whole presentations and
+    clipped to the run once, and all signals are loaded for it. `images`
+    are the test images of the run (see `record.py`), used for plotting
+    the first `max_pres` presentations. With `params`, the synaptic
+    operations of the window's spikes are printed. Returns the errors of
+    the window's presentations.
+    """
+    pres_time = float(rec['pres_time'])
+    window = window if window is not None else (0, None)
+    t_end = rec.t0 + rec.dt * (rec.n_steps - 1)
+    tstop = t_end if window[1] is None else min(window[1], t_end)
+    tstart, tstop = presentation_window(window[0], tstop, pres_time)
+
+    t = rec.t(tstart, tstop)
+    test = rec.load('test', tstart, tstop)
+    classifier = rec.load('classifier', tstart, tstop)
+    errors = compute_spiking_error(t, test, pres_time)
+    print("Spiking network error: %0.2f%%" % (100 * errors.mean()))
+
+    i = int(round(tstart / pres_time))
+    labels = rec['labels'][i:]
+    if latency:
+        view_spiking_latency(*compute_spiking_latency(
+            t, classifier, labels, pres_time, classes=rec['classes']))
+
+    layers = rec.load_spikes(tstart, tstop) if show_spikes or params else []
+    if params is not None:
+        print_spiking_cost(compute_spiking_cost(
+            inference.load_params(params), layers, pres_time, rec.dt))
+
+    if images is not None and max_pres > 0:
+        image_index = rec['image_index'][i:i + max_pres]
+        view_spiking(t, images[image_index], labels[:max_pres], classifier,
+                     test, pres_time, max_pres=max_pres,
+                     layers=layers if show_spikes else [])
+    return errors
+
+
+def test_latency():
+    """Score the latency of a run longer than its labels"""
+    dt, pres_time = 0.001, 0.1
+    pres_len = int(round(pres_time / dt))
+    labels = np.array([0, 1, 2])
+    outputs = np.repeat(np.eye(3)[[0, 1, 2, 2]], pres_len, axis=0)
+    outputs[:pres_len // 2, :] = np.eye(3)[1]  # first decision at 50 ms
+    t = dt * np.arange(1, len(outputs) + 1)
+    _, error, latency = compute_spiking_latency(t, outputs, labels, pres_time)
+    assert len(latency) == len(labels)
+    assert np.allclose(latency, [0.051, 0.001, 0.001])
+    assert np.allclose(error[[0, -1]], [1. / 3, 0])
+
+
+def test_window():
+    """View record windows that do not end on presentation boundaries"""
+    import shutil
+    import tempfile
+    import matplotlib
+    matplotlib.use('Agg')
+
+    dt, pres_time, n_pres = 0.001, 0.1, 5
+    pres_len = int(round(pres_time / dt))
+    t = dt * np.arange(1, n_pres * pres_len + 1)
+    test = np.repeat([1., 0., 1., 1., 0.], pres_len)
+    labels = np.arange(n_pres) % 3
+    classifier = np.repeat(np.eye(3)[labels], pres_len, axis=0)
+    rng = np.random.RandomState(7)
+    layer = spikes.SpikeEvents.from_dense(
+        (rng.rand(len(t), 20) < 0.05) / dt, dt)
+    images = rng.rand(n_pres, 784)
+    path = tempfile.mkdtemp()
+    try:
+        record.save(path, t, dict(test=test[:, None], classifier=classifier),
+                    compress=['classifier'], chunk_len=70, layers=[layer],
+                    pres_time=pres_time, classes=np.arange(3), labels=labels,
+                    image_index=np.arange(n_pres), spaun=False)
+        rec = record.Record(path)
+        tstart, tstop = presentation_window(0.05, 0.25, pres_time)
+        assert np.allclose([tstart, tstop], [0, 0.2])
+        errors = compute_spiking_error(
+            rec.t(tstart, tstop), rec.load('test', tstart, tstop), pres_time)
+        assert np.array_equal(errors, [False, True])
+
+        # plot fewer presentations than scored, and a window past the end
+        for window, expected in [((0.1, 0.35), [True, False]),
+                                 ((0.25, 9.), [False, False, True])]:
+            errors = view_record(rec, window=window, images=images,
+                                 max_pres=1, latency=True)
+            assert np.array_equal(errors, expected)
+    finally:
+        shutil.rmtree(path)
+
+
 if __name__ == '__main__':
     # --- arguments
     parser = argparse.ArgumentParser(
         description="View network or spiking network results")
     parser.add_argument('--spaun', action='store_true',
                         help="Test with augmented dataset for Spaun")
-    parser.add_argument('loadfile', help="Parameter file to load")
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help="Images per chunk for static evaluation")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Threads for static evaluation (on top of "
+                        "the BLAS threads)")
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        default='float64',
+                        help="Precision for static evaluation")
+    parser.add_argument('--window', type=float, nargs=2, default=None,
+                        metavar=('START', 'STOP'),
+                        help="Time window of a spiking record to view [s]")
+    parser.add_argument('--presentations', type=int, default=20,
+                        help="Number of presentations to plot")
+    parser.add_argument('--no-spikes', action='store_true',
+                        help="Do not load layer spikes of a spiking record")
+    parser.add_argument('--latency', action='store_true',
+                        help="Show error over time since onset and decision "
+                        "latencies of a spiking record")
+    parser.add_argument('--params', default=None,
+                        help="Params file of a spiking record's network, "
+                        "to compute its synaptic operations")
+    parser.add_argument('--profile', action='store_true',
+                        help="Time the loading, analysis and plotting, and "
+                        "save a profile")
+    parser.add_argument('loadfile',
+                        help="Parameter file or spiking record to load")
     args = parser.parse_args()
+    profiling.enable(args.profile)
 
     if not os.path.exists(args.loadfile):
         raise IOError("Cannot find '%s'" % args.loadfile)
 
+    if record.is_record(args.loadfile):
+        # Spiking run record directory: load only the requested window
+        rec = record.Record(args.loadfile)
+        images = None
+        if args.presentations > 0:
+            _, _, [images, _] = mnist.load(
+                shuffle=True, spaun=bool(rec['spaun']), compact=True)
+        view_record(rec, window=args.window, images=images,
+                    max_pres=args.presentations,
+                    show_spikes=not args.no_spikes, latency=args.latency,
+                    params=args.params)
+        sys.exit(0)
+
     data = np.load(args.loadfile)
-    if all(a in data for a in ['weights', 'biases', 'Wc', 'bc']):
-        # Static network params file
-        if 'neuron' in data:
-            _, neuron_params = data['neuron']
-        else:
-            neuron_params = dict(sigma=0.01, tau_rc=0.02, tau_ref=0.002,
-                                 gain=1, bias=1, amp=1. / 63.04)
+    if inference.is_params(data.files):
+        # Static network params file (quantized files are dequantized)
+        params = inference.load_params(args.loadfile)
+        _, neuron_params = params['neuron']
 
         # --- load the testing data
         _, _, [images, labels] = mnist.load(
-            normalize=True, shuffle=True, spaun=args.spaun)
-        assert np.unique(labels).size == data['bc'].size
-
-        # --- compute the error
-        neuron = ('softlif', dict(neuron_params))
-        errors = compute_static_error(data, images, labels, neuron)
-        print("----- Static network with softlif -----")
-        print("Static error: %0.2f%%" % (100 * errors.mean()))
-
-        neuron = ('lif', dict(neuron_params))
-        neuron[1].pop('sigma')
-        errors = compute_static_error(data, images, labels, neuron)
-        print("----- Static network with lif -----")
-        print("Static error: %0.2f%%" % (100 * errors.mean()))
-        view_static(data, images, labels, neuron)
+            normalize=True, shuffle=True, spaun=args.spaun, compact=True,
+            stats=mnist.params_stats(params))
+        assert np.unique(labels).size == params['bc'].size
+
+        # --- compute the error for softlif and lif in one pass
+        neurons_list = inference.static_variants(neuron_params)
+        stats = compute_static_stats(
+            params, images, labels, neurons_list, chunk_size=args.chunk_size,
+            n_threads=args.threads, dtype=args.dtype)
+        for [name, _], stat in zip(neurons_list, stats):
+            print("----- Static network with %s -----" % name)
+            print("Static error: %0.2f%%" % (100 * stat['errors'].mean()))
+        view_static(stats[-1])
 
     elif all(a in data for a in ['t', 'classifier', 'test']):
         # Spiking run record file
 
         # --- compute the error
-        args = dict((a, data[a]) for a in ['t', 'test', 'pres_time'])
-        errors = compute_spiking_error(**args)
+        errors = compute_spiking_error(
+            **dict((a, data[a]) for a in ['t', 'test', 'pres_time']))
         print("Spiking network error: %0.2f%%" % (100 * errors.mean()))
 
-        args = dict((a, data[a]) for a in [
+        if args.latency:
+            view_spiking_latency(*compute_spiking_latency(
+                data['t'], data['classifier'], data['labels'],
+                float(data['pres_time']), classes=data['classes']))
+
+        layers = spikes.from_dict(data)
+        if args.params is not None:
+            dt = float(data['t'][1] - data['t'][0])
+            print_spiking_cost(compute_spiking_cost(
+                inference.load_params(args.params), layers,
+                float(data['pres_time']), dt))
+
+        kwargs = dict((a, data[a]) for a in [
             't', 'images', 'labels', 'classifier', 'test', 'pres_time'])
-        view_spiking(**args)
+        view_spiking(layers=layers, max_pres=args.presentations, **kwargs)
     else:
         raise ValueError("Unrecognized load file type")